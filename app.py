@@ -1,47 +1,116 @@
+import fcntl  # Import file locks so only one process rebuilds the snapshot at a time
+import gc  # Import garbage collector to freeze objects created before forking
+import time  # Import time to measure startup
 from config import Config  # Import configuration settings
 from flask import Flask  # Import Flask for building the web application
-from models import init_db  # Import function to initialize the database
+from models import mysql as mysql_db, init_db, get_mysql_connection  # Import database extension and helpers
 from flask_jwt_extended import JWTManager  # Import JWT for authentication
 from apscheduler.schedulers.background import BackgroundScheduler  # Import scheduler for background tasks
 import mysql.connector  # Use mysql.connector to connect to MySQL database
+from services.auth_service import revoked_tokens  # Import the refresh token revocation set
+from services.geo_index import station_locations  # Import the nearest-station index
+from services.profiling import init_profiling  # Import request profiling and slow-query tracing
+from services.timetable_service import compact_changes, get_current_version  # Import change log helpers
+from services.timetable_snapshot import build_snapshot, read_snapshot_version, timetable_snapshot  # Import timetable snapshot helpers
+
+# Extensions are created once and bound to an app by `create_app`
+jwt = JWTManager()  # JWT authentication
+scheduler = BackgroundScheduler()  # Scheduler for periodic background tasks
+
+@jwt.token_in_blocklist_loader
+def is_token_revoked(jwt_header, jwt_payload):
+    """Reject refresh tokens that have been rotated or logged out (in-memory check)."""
+    return jwt_payload['type'] == 'refresh' and revoked_tokens.is_revoked(jwt_payload['jti'])
+
+def create_app():
+    """
+    Create and configure the Flask application.
+
+    Only cheap, side-effect free setup happens here: no database connection is
+    opened and the scheduler is not started, so the app can be built in a
+    master process and forked into workers. Call `warm_app` to prepare the
+    database, and `start_scheduler` (development server) or `jobs.py` to run
+    background jobs.
+
+    Steps:
+    1. Set MySQL and JWT configurations from the Config class.
+    2. Bind the MySQL and JWT extensions to the app.
+    3. Register all route blueprints.
+    4. Install request profiling and slow-query tracing.
+    5. Record how long startup took in `app.config['STARTUP_TIMINGS']`.
 
-# Initialize Flask app
-app = Flask(__name__)  # Create Flask application instance
-jwt = JWTManager(app)  # Initialize JWT authentication with the app
-
-# Register routes (import and attach blueprints)
-from routes.auth import auth_routes
-from routes.station import station_routes
-from routes.wallet import wallet_routes
-from routes.ticket import ticket_routes
-from routes.train import train_routes
-
-app.register_blueprint(auth_routes)  # Register auth-related routes
-app.register_blueprint(station_routes)  # Register station-related routes
-app.register_blueprint(wallet_routes)  # Register wallet-related routes
-app.register_blueprint(ticket_routes)  # Register ticket-related routes
-app.register_blueprint(train_routes)  # Register train-related routes
-
-# Set MySQL and JWT configurations from the Config class
-app.config['MYSQL_HOST'] = Config.MYSQL_HOST
-app.config['MYSQL_USER'] = Config.MYSQL_USER
-app.config['MYSQL_PASSWORD'] = Config.MYSQL_PASSWORD
-app.config['MYSQL_DB'] = Config.MYSQL_DB
-app.config['JWT_SECRET_KEY'] = Config.JWT_SECRET_KEY
-
-def get_mysql_connection():
-    """
-    Establish a new MySQL connection using mysql.connector.
-    
     Returns:
-        MySQL connection object.
+        Flask application instance.
     """
-    return mysql.connector.connect(
-        host=Config.MYSQL_HOST,
-        user=Config.MYSQL_USER,
-        password=Config.MYSQL_PASSWORD,
-        database=Config.MYSQL_DB,
-    )
+    started = time.perf_counter()
+    app = Flask(__name__)  # Create Flask application instance
+
+    # Set MySQL and JWT configurations from the Config class
+    app.config['MYSQL_HOST'] = Config.MYSQL_HOST
+    app.config['MYSQL_USER'] = Config.MYSQL_USER
+    app.config['MYSQL_PASSWORD'] = Config.MYSQL_PASSWORD
+    app.config['MYSQL_DB'] = Config.MYSQL_DB
+    app.config['JWT_SECRET_KEY'] = Config.JWT_SECRET_KEY
+
+    mysql_db.init_app(app)  # Bind the MySQL instance to the Flask app (connects lazily)
+    jwt.init_app(app)  # Initialize JWT authentication with the app
+
+    # Register routes (import and attach blueprints)
+    from routes.auth import auth_routes
+    from routes.station import station_routes
+    from routes.wallet import wallet_routes
+    from routes.ticket import ticket_routes
+    from routes.train import train_routes
+    from routes.report import report_routes
+
+    app.register_blueprint(auth_routes)  # Register auth-related routes
+    app.register_blueprint(station_routes)  # Register station-related routes
+    app.register_blueprint(wallet_routes)  # Register wallet-related routes
+    app.register_blueprint(ticket_routes)  # Register ticket-related routes
+    app.register_blueprint(train_routes)  # Register train-related routes
+    app.register_blueprint(report_routes)  # Register reporting routes
+
+    init_profiling(app)  # Time every request and its SQL, and profile on demand
+
+    app.config['STARTUP_TIMINGS'] = {"create_app_ms": (time.perf_counter() - started) * 1000}
+    return app
+
+def warm_app(app):
+    """
+    Prepare the app to serve traffic, ideally once before workers are forked.
+
+    Steps:
+    1. Initialize the database by calling `init_db`.
+    2. Load the revoked refresh tokens and tickets and the station coordinate index into memory.
+    3. Build the timetable snapshot if it is out of date and map it, so forked
+       workers start with it already loaded.
+    4. Collect garbage and freeze every object created so far, so forked workers
+       share those memory pages copy-on-write instead of dirtying them on the
+       next garbage collection.
+    5. Record and print the warm-up time next to the `create_app` time.
+
+    Parameters:
+    - app: The Flask application instance.
+    """
+    started = time.perf_counter()
+    from routes.ticket import ticket_signer
+
+    init_db(app)  # Ensure all tables are created if they don't exist
+    with app.app_context():
+        cursor = mysql_db.connection.cursor()
+        revoked_tokens.load(cursor)
+        ticket_signer.load_revoked(cursor)
+        station_locations.sync(cursor, force=True)
+        cursor.close()
+    refresh_timetable_snapshot()
+    timetable_snapshot.current()
+
+    gc.collect()
+    gc.freeze()
+
+    timings = app.config.setdefault('STARTUP_TIMINGS', {})
+    timings['warm_app_ms'] = (time.perf_counter() - started) * 1000
+    print("Startup timings: " + ", ".join(f"{name}={ms:.1f}" for name, ms in timings.items()))
 
 def expire_tickets():
     """
@@ -79,21 +148,119 @@ def expire_tickets():
         # Print error message if MySQL operation fails
         print(f"Error during ticket expiration: {err}")
 
-# Initialize the APScheduler to run periodic tasks in the background
-scheduler = BackgroundScheduler()
-scheduler.add_job(
-    expire_tickets, 'interval', hours=1  # Schedule `expire_tickets` to run every hour
-)
-scheduler.start()  # Start the scheduler
+def compact_timetable_changes():
+    """
+    Trim the timetable change log to the most recent versions.
+
+    Keeps the latest `TIMETABLE_CHANGELOG_RETENTION` versions. Clients syncing from
+    an older version get a full snapshot from `GET /trains?since=`.
+    """
+    try:
+        connection = get_mysql_connection()  # Get new MySQL connection
+        cursor = connection.cursor()  # Create a cursor to execute queries
+
+        compact_changes(cursor, Config.TIMETABLE_CHANGELOG_RETENTION)
+        connection.commit()  # Commit the changes
+        cursor.close()  # Close the cursor
+        connection.close()  # Close the connection
+
+    except mysql.connector.Error as err:
+        # Print error message if MySQL operation fails
+        print(f"Error during timetable change log compaction: {err}")
+
+def prune_revoked_tokens():
+    """
+    Delete revoked refresh tokens that have expired anyway.
+    """
+    try:
+        connection = get_mysql_connection()  # Get new MySQL connection
+        cursor = connection.cursor()  # Create a cursor to execute queries
+
+        cursor.execute("DELETE FROM revoked_tokens WHERE expires_at <= UTC_TIMESTAMP()")
+        connection.commit()  # Commit the changes
+        cursor.close()  # Close the cursor
+        connection.close()  # Close the connection
+
+    except mysql.connector.Error as err:
+        # Print error message if MySQL operation fails
+        print(f"Error during revoked token cleanup: {err}")
+
+def refresh_timetable_snapshot():
+    """
+    Rebuild the memory-mapped timetable snapshot when the timetable version has changed.
+
+    The snapshot file is replaced atomically. Worker processes notice the new file
+    and swap their mapping on their next read. Several processes may call this at
+    the same time (e.g. every `uvicorn asgi:app` worker); while one of them holds
+    the lock file next to the snapshot, the others skip the refresh.
+    """
+    with open(Config.TIMETABLE_SNAPSHOT_PATH + '.lock', 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return  # Another process is refreshing the snapshot right now
+
+        try:
+            connection = get_mysql_connection()  # Get new MySQL connection
+            cursor = connection.cursor(buffered=True)  # Create a cursor to execute queries
+
+            if read_snapshot_version(Config.TIMETABLE_SNAPSHOT_PATH) != get_current_version(cursor):
+                build_snapshot(cursor, Config.TIMETABLE_SNAPSHOT_PATH)
+            cursor.close()  # Close the cursor
+            connection.close()  # Close the connection
+
+        except mysql.connector.Error as err:
+            # Print error message if MySQL operation fails
+            print(f"Error during timetable snapshot refresh: {err}")
+
+def add_jobs(job_scheduler):
+    """
+    Register the periodic tasks on an APScheduler scheduler.
+
+    The jobs must run in exactly one process: the development server's scheduler
+    (`start_scheduler`) or the dedicated jobs process (`jobs.py`).
+    """
+    job_scheduler.add_job(
+        expire_tickets, 'interval', hours=1  # Schedule `expire_tickets` to run every hour
+    )
+    job_scheduler.add_job(
+        compact_timetable_changes, 'interval', hours=1  # Schedule change log compaction every hour
+    )
+    job_scheduler.add_job(
+        prune_revoked_tokens, 'interval', hours=1  # Schedule revoked token cleanup every hour
+    )
+    job_scheduler.add_job(
+        refresh_timetable_snapshot, 'interval', seconds=Config.TIMETABLE_SNAPSHOT_INTERVAL  # Keep the snapshot current
+    )
+
+def start_scheduler():
+    """
+    Start the APScheduler to run periodic tasks in a background thread.
+
+    Only for the single-process development server. Never call this in a process
+    that forks afterwards: a child forked while the job thread holds a lock (e.g.
+    inside the MySQL driver) inherits it locked. Production servers run the jobs
+    in their own process instead (see `jobs.py`).
+    """
+    if scheduler.running:
+        return
+    add_jobs(scheduler)
+    scheduler.start()  # Start the scheduler
 
 # Main application entry point
 if __name__ == '__main__':
     """
-    Initialize the database and start the Flask server.
-    
+    Initialize the database and start the Flask development server.
+
     Steps:
-    1. Initialize the database by calling `init_db`.
-    2. Start the Flask development server with debugging enabled.
+    1. Create the app with `create_app`.
+    2. Initialize the database by calling `warm_app`.
+    3. Start the background scheduler.
+    4. Start the Flask development server with debugging enabled.
+
+    For production, use `gunicorn -c gunicorn.conf.py wsgi:app` instead.
     """
-    init_db(app)  # Ensure all tables are created if they don't exist
+    app = create_app()
+    warm_app(app)
+    start_scheduler()
     app.run(debug=True)  # Start the Flask server with debugging enabled
@@ -0,0 +1,189 @@
+import asyncio
+import aiomysql  # Async MySQL driver and connection pool
+from a2wsgi import WSGIMiddleware  # Serve the Flask app for the remaining routes
+from contextlib import asynccontextmanager
+from flask_jwt_extended import decode_token  # Verify access tokens exactly like the Flask routes
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt import PyJWTError
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import create_app, refresh_timetable_snapshot, warm_app
+from config import Config
+from models import get_mysql_connection
+from services.schedule_events import schedule_events
+from services.timetable_service import (
+    CHANGED_ENTITIES_QUERY, OLDEST_CHANGE_QUERY, VERSION_QUERY,
+    format_stations, format_train_schedules, group_changes, needs_full_sync,
+    stations_query, train_schedules_query
+)
+from services.timetable_snapshot import timetable_snapshot
+from services.wallet_service import TRANSACTION_HISTORY_QUERY, format_transactions
+
+# Async serving mode: `uvicorn asgi:app`
+# The read endpoints below run on the event loop with an async connection pool, so
+# one process can hold thousands of concurrent (mostly idle) polling requests.
+# Every other route is served by the regular Flask app in a thread pool.
+
+
+async def _fetch(cursor, query):
+    if query is None:
+        return []
+    await cursor.execute(*query)
+    return await cursor.fetchall()
+
+def _int_or_none(value):
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+async def _fetch_value(cursor, query, params=()):
+    await cursor.execute(query, params)
+    row = await cursor.fetchone()
+    return row[0] if row else None
+
+def _jwt_identity(request):
+    """
+    Return the user id from a valid `Authorization: Bearer <token>` access token, or None.
+
+    Tokens are decoded by flask-jwt-extended with the Flask app's `JWT_*` settings,
+    so both serving modes accept exactly the same tokens.
+    """
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme != 'Bearer' or not token:
+        return None
+    with flask_app.app_context():
+        try:
+            claims = decode_token(token)
+        except (JWTExtendedException, PyJWTError):
+            return None
+        if claims.get('type') != 'access':
+            return None
+        return claims.get(flask_app.config['JWT_IDENTITY_CLAIM'])
+
+
+async def get_all_stations(request):
+    """Async version of `GET /stations`."""
+    async with request.app.state.pool.acquire() as connection:
+        async with connection.cursor() as cursor:
+            rows = await _fetch(cursor, stations_query())
+
+    return JSONResponse(format_stations(rows))
+
+async def get_all_train_schedules(request):
+    """Async version of `GET /trains`, including `?since=` delta sync."""
+    since = _int_or_none(request.query_params.get('since'))
+
+    async with request.app.state.pool.acquire() as connection:
+        async with connection.cursor() as cursor:
+            version = await _fetch_value(cursor, VERSION_QUERY) or 0
+            if since is None:
+                snapshot = timetable_snapshot.current()
+                if snapshot is not None and snapshot.version == version:
+                    train_list = snapshot.train_schedules()
+                else:
+                    train_list = format_train_schedules(await _fetch(cursor, train_schedules_query()))
+                return JSONResponse(train_list, headers={"X-Timetable-Version": str(version)})
+
+            oldest = await _fetch_value(cursor, OLDEST_CHANGE_QUERY)
+            if needs_full_sync(since, version, oldest):
+                changed = {"train": None, "station": None}
+            else:
+                await cursor.execute(CHANGED_ENTITIES_QUERY, (since, version))
+                changed = group_changes(await cursor.fetchall())
+            trains = await _fetch(cursor, train_schedules_query(changed["train"]))
+            stations = await _fetch(cursor, stations_query(changed["station"]))
+
+    return JSONResponse({
+        "version": version,
+        "full": changed["train"] is None,
+        "trains": format_train_schedules(trains),
+        "stations": format_stations(stations)
+    })
+
+async def stream_train_schedules(request):
+    """
+    Async version of `GET /trains/stream`.
+
+    Subscribers wait on the event loop instead of holding a thread each, so one
+    process can keep thousands of streams open.
+    """
+    train_id = _int_or_none(request.query_params.get('train_id'))
+    station_id = _int_or_none(request.query_params.get('station_id'))
+    last_event_id = _int_or_none(request.headers.get('Last-Event-ID'))
+
+    await run_in_threadpool(schedule_events.ensure_feed, get_mysql_connection, Config.SCHEDULE_FEED_INTERVAL)
+    events = schedule_events.alisten(
+        last_event_id, train_id, station_id, heartbeat=Config.SCHEDULE_STREAM_HEARTBEAT
+    )
+
+    return StreamingResponse(events, media_type='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # Stop reverse proxies from buffering the stream
+    })
+
+async def transaction_history(request):
+    """Async version of `GET /wallet/history`."""
+    user_id = _jwt_identity(request)
+    if user_id is None:
+        return JSONResponse({"msg": "Missing or invalid access token"}, status_code=401)
+
+    async with request.app.state.pool.acquire() as connection:
+        async with connection.cursor() as cursor:
+            await cursor.execute(TRANSACTION_HISTORY_QUERY, (user_id,))
+            rows = await cursor.fetchall()
+
+    return JSONResponse(format_transactions(rows))
+
+
+flask_app = create_app()
+
+
+async def refresh_snapshot_periodically():
+    """
+    Keep the timetable snapshot current without a jobs process.
+
+    Every worker runs this loop; `refresh_timetable_snapshot` lets only one of
+    them rebuild at a time and the others map the new file on their next read.
+    """
+    while True:
+        await asyncio.sleep(Config.TIMETABLE_SNAPSHOT_INTERVAL)
+        await run_in_threadpool(refresh_timetable_snapshot)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Warm the Flask app, open the async connection pool and start the snapshot
+    refresh on startup; stop both on shutdown.
+    """
+    warm_app(flask_app)
+    app.state.pool = await aiomysql.create_pool(
+        host=Config.MYSQL_HOST,
+        user=Config.MYSQL_USER,
+        password=Config.MYSQL_PASSWORD,
+        db=Config.MYSQL_DB,
+        minsize=Config.ASYNC_POOL_MIN_SIZE,
+        maxsize=Config.ASYNC_POOL_MAX_SIZE,
+        autocommit=True,  # Read-only queries, always see the latest commits
+    )
+    snapshot_refresh = asyncio.create_task(refresh_snapshot_periodically())
+    yield
+    snapshot_refresh.cancel()
+    app.state.pool.close()
+    await app.state.pool.wait_closed()
+
+
+app = Starlette(
+    routes=[
+        Route('/stations', get_all_stations, methods=['GET']),
+        Route('/trains', get_all_train_schedules, methods=['GET']),
+        Route('/trains/stream', stream_train_schedules, methods=['GET']),
+        Route('/wallet/history', transaction_history, methods=['GET']),
+        Mount('/', WSGIMiddleware(flask_app)),
+    ],
+    lifespan=lifespan,
+)
@@ -1,5 +1,7 @@
 import os
+import tempfile
 from dotenv import load_dotenv
+from services.ticket_signing import derive_key
 
 # Load environment variables from .env
 load_dotenv()
@@ -10,3 +12,29 @@ class Config:
     MYSQL_PASSWORD = os.getenv('MYSQL_PASSWORD')
     MYSQL_DB = os.getenv('MYSQL_DB')
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY')
+    TIMETABLE_CHANGELOG_RETENTION = int(os.getenv('TIMETABLE_CHANGELOG_RETENTION', 10000))
+    SCHEDULE_STREAM_HEARTBEAT = int(os.getenv('SCHEDULE_STREAM_HEARTBEAT', 15))
+    SCHEDULE_STREAM_BUFFER = int(os.getenv('SCHEDULE_STREAM_BUFFER', 1024))
+    SCHEDULE_FEED_INTERVAL = float(os.getenv('SCHEDULE_FEED_INTERVAL', 1.0))
+    SCHEDULE_STREAM_MAX_THREADS = int(os.getenv('SCHEDULE_STREAM_MAX_THREADS', 4))  # Per process, WSGI only
+    ASYNC_POOL_MIN_SIZE = int(os.getenv('ASYNC_POOL_MIN_SIZE', 1))
+    ASYNC_POOL_MAX_SIZE = int(os.getenv('ASYNC_POOL_MAX_SIZE', 20))
+    TIMETABLE_SNAPSHOT_PATH = os.getenv(
+        'TIMETABLE_SNAPSHOT_PATH', os.path.join(tempfile.gettempdir(), f"timetable-{MYSQL_DB}.snap")
+    )
+    TIMETABLE_SNAPSHOT_INTERVAL = int(os.getenv('TIMETABLE_SNAPSHOT_INTERVAL', 30))
+    REFRESH_TOKEN_DAYS = int(os.getenv('REFRESH_TOKEN_DAYS', 30))
+    ROLLUP_SLOTS = int(os.getenv('ROLLUP_SLOTS', 16))  # Rows per rollup bucket, spreads row locks
+    STATION_PLATFORMS = int(os.getenv('STATION_PLATFORMS', 1))
+    SCHEDULE_CONFLICT_MODE = os.getenv('SCHEDULE_CONFLICT_MODE', 'warn')  # 'warn' or 'reject'
+    # Copied to gate devices, so it must not be the JWT secret itself
+    TICKET_SIGNING_KEY = os.getenv('TICKET_SIGNING_KEY') or (JWT_SECRET_KEY and derive_key(JWT_SECRET_KEY))
+    TICKET_GRACE_HOURS = float(os.getenv('TICKET_GRACE_HOURS', 6))
+    TICKET_REVOCATION_REFRESH = float(os.getenv('TICKET_REVOCATION_REFRESH', 30))  # Seconds between reloads of invalid tickets
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))  # Fraction of requests to profile, 0 to 1
+    PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')  # Requests sending it in 'X-Profile-Token' are profiled
+    PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', 5))
+    PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'profiles'))
+    PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', 200))  # Profiles kept, older ones are deleted
+    SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', 500))
+    SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 100))
@@ -0,0 +1,47 @@
+import multiprocessing
+import os
+import subprocess
+import sys
+
+# Bind address and worker layout, overridable from the environment
+bind = os.getenv('BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', 8))  # Requests are mostly waiting on MySQL
+keepalive = 5
+
+# Build and warm the app once in the master, then fork workers from it
+preload_app = True
+
+# Recycle workers now and then so slow leaks cannot grow without bound
+max_requests = 10000
+max_requests_jitter = 1000
+
+# The periodic jobs run in a separate `python jobs.py` process. Starting their
+# scheduler thread in the master would let workers be forked (also later, when
+# they are recycled) while a job thread holds a lock, leaving it locked for good.
+# Set RUN_JOBS=0 when the jobs process is run and supervised elsewhere.
+run_jobs = os.getenv('RUN_JOBS', '1') == '1'
+jobs_process = None
+
+def start_jobs(server):
+    global jobs_process
+    if run_jobs and (jobs_process is None or jobs_process.poll() is not None):
+        if jobs_process is not None:
+            server.log.warning("Jobs process exited with %s, restarting", jobs_process.returncode)
+        # A fresh interpreter (fork + exec), so nothing is inherited from the master
+        jobs_process = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(__file__), 'jobs.py')])
+
+def when_ready(server):
+    """Start the jobs process once the master is up."""
+    start_jobs(server)
+
+def pre_fork(server, worker):
+    """Restart the jobs process if it died; called whenever a worker is (re)started."""
+    start_jobs(server)
+
+def on_exit(server):
+    """Stop the jobs process together with the server."""
+    if jobs_process is not None and jobs_process.poll() is None:
+        jobs_process.terminate()
+        jobs_process.wait(timeout=30)
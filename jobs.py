@@ -0,0 +1,12 @@
+from apscheduler.schedulers.blocking import BlockingScheduler
+
+from app import add_jobs
+
+# Background jobs entry point: `python jobs.py`
+# Runs the periodic tasks in a process of their own, so no web server process
+# ever forks while a job thread is running. `gunicorn.conf.py` starts it next to
+# the workers; with `uvicorn asgi:app`, run it yourself (exactly one per database).
+if __name__ == '__main__':
+    job_scheduler = BlockingScheduler()
+    add_jobs(job_scheduler)
+    job_scheduler.start()
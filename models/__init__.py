@@ -1,8 +1,26 @@
 from flask_mysqldb import MySQL  # Import MySQL extension for Flask
+from config import Config  # Import configuration settings
+import mysql.connector as mysql_connector  # Use mysql.connector for connections outside of requests
 
 # Initialize the MySQL object to be used across the app
 mysql = MySQL()
 
+def get_mysql_connection():
+    """
+    Establish a new MySQL connection using mysql.connector.
+
+    Used by background jobs and threads that run outside of a Flask request.
+
+    Returns:
+        MySQL connection object.
+    """
+    return mysql_connector.connect(
+        host=Config.MYSQL_HOST,
+        user=Config.MYSQL_USER,
+        password=Config.MYSQL_PASSWORD,
+        database=Config.MYSQL_DB,
+    )
+
 def create_users_table(cursor):
     """
     Create the 'users' table if it does not exist.
@@ -30,15 +48,31 @@ def create_stations_table(cursor):
     - id: Primary key, auto-incremented.
     - name: Name of the station.
     - location: Location or address of the station.
+    - latitude: Latitude of the station in degrees, NULL if unknown.
+    - longitude: Longitude of the station in degrees, NULL if unknown.
     """
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS stations (
             id INT AUTO_INCREMENT PRIMARY KEY,
             name VARCHAR(100),
-            location VARCHAR(100)
+            location VARCHAR(100),
+            latitude DOUBLE NULL,
+            longitude DOUBLE NULL
         )
     """)
 
+def add_station_coordinates(cursor):
+    """
+    Add the 'latitude' and 'longitude' columns to a 'stations' table created
+    before they existed.
+    """
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = 'stations' AND column_name = 'latitude'
+    """)
+    if not cursor.fetchone()[0]:
+        cursor.execute("ALTER TABLE stations ADD COLUMN latitude DOUBLE NULL, ADD COLUMN longitude DOUBLE NULL")
+
 def create_trains_table(cursor):
     """
     Create the 'trains' table if it does not exist.
@@ -95,6 +129,7 @@ def create_tickets_table(cursor):
     - price: Price of the ticket.
     - timestamp: Timestamp when the ticket was created.
     - is_valid: Boolean indicating if the ticket is still valid (default is TRUE).
+    - service_date: Travel date the ticket is signed for, NULL for tickets sold before it was stored.
 
     Constraints:
     - Cascading deletes on related entities (users, trains, stations).
@@ -109,6 +144,7 @@ def create_tickets_table(cursor):
             price FLOAT,
             timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             is_valid BOOLEAN DEFAULT TRUE,
+            service_date DATE NULL,
             FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
             FOREIGN KEY (train_id) REFERENCES trains(id) ON DELETE CASCADE,
             FOREIGN KEY (from_station) REFERENCES stations(id) ON DELETE CASCADE,
@@ -116,6 +152,17 @@ def create_tickets_table(cursor):
         )
     """)
 
+def add_ticket_service_date(cursor):
+    """
+    Add the 'service_date' column to a 'tickets' table created before it existed.
+    """
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = 'tickets' AND column_name = 'service_date'
+    """)
+    if not cursor.fetchone()[0]:
+        cursor.execute("ALTER TABLE tickets ADD COLUMN service_date DATE NULL")
+
 def create_transectionHistory_table(cursor):
     """
     Create the 'transactions' table to log wallet transactions.
@@ -141,32 +188,178 @@ def create_transectionHistory_table(cursor):
         )
     """)
 
+def create_timetable_version_table(cursor):
+    """
+    Create the 'timetable_version' table if it does not exist.
+
+    This single-row table holds the current timetable version. Writers bump it
+    with a row lock that is held until their transaction commits, so versions
+    become visible in the same order they were handed out.
+
+    Fields:
+    - id: Primary key, always 1.
+    - version: The latest timetable version.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS timetable_version (
+            id TINYINT PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute("INSERT IGNORE INTO timetable_version (id, version) VALUES (1, 0)")
+
+def create_timetable_changes_table(cursor):
+    """
+    Create the 'timetable_changes' table to log timetable mutations.
+
+    Fields:
+    - version: Primary key, the timetable version produced by the change.
+    - entity: Enum type ('train' or 'station') indicating what changed.
+    - entity_id: ID of the changed train or station.
+    - timestamp: Timestamp when the change was recorded.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS timetable_changes (
+            version BIGINT PRIMARY KEY,
+            entity ENUM('train', 'station') NOT NULL,
+            entity_id INT NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def create_ticket_sales_hourly_table(cursor):
+    """
+    Create the 'ticket_sales_hourly' rollup table if it does not exist.
+
+    Rows are keyed by hour, train, origin-destination pair and slot, and are updated
+    in the same transaction as every ticket purchase so reports never scan 'tickets'.
+
+    Fields:
+    - hour: Start of the hour the tickets were sold in.
+    - train_id: ID of the train.
+    - from_station: ID of the origin station.
+    - to_station: ID of the destination station.
+    - slot: Buyer's user id modulo `ROLLUP_SLOTS`; reports sum over slots.
+    - tickets_sold: Number of tickets sold.
+    - revenue: Total price of the tickets sold.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ticket_sales_hourly (
+            hour DATETIME,
+            train_id INT,
+            from_station INT,
+            to_station INT,
+            slot SMALLINT NOT NULL DEFAULT 0,
+            tickets_sold INT NOT NULL DEFAULT 0,
+            revenue DOUBLE NOT NULL DEFAULT 0,
+            PRIMARY KEY (hour, train_id, from_station, to_station, slot)
+        )
+    """)
+
+def create_wallet_funds_hourly_table(cursor):
+    """
+    Create the 'wallet_funds_hourly' rollup table if it does not exist.
+
+    Rows are keyed by hour and slot, and are updated in the same transaction as
+    every wallet top-up.
+
+    Fields:
+    - hour: Start of the hour the funds were added in.
+    - slot: User id modulo `ROLLUP_SLOTS`; reports sum over slots.
+    - topups: Number of top-ups.
+    - funds_added: Total amount added to wallets.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS wallet_funds_hourly (
+            hour DATETIME,
+            slot SMALLINT NOT NULL DEFAULT 0,
+            topups INT NOT NULL DEFAULT 0,
+            funds_added DOUBLE NOT NULL DEFAULT 0,
+            PRIMARY KEY (hour, slot)
+        )
+    """)
+
+def add_rollup_slots(cursor):
+    """
+    Add the 'slot' column to the primary key of rollup tables created before it existed.
+    Existing rows are kept in slot 0.
+    """
+    for table, key in (
+        ('ticket_sales_hourly', 'hour, train_id, from_station, to_station, slot'),
+        ('wallet_funds_hourly', 'hour, slot'),
+    ):
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = %s AND column_name = 'slot'
+        """, (table,))
+        if not cursor.fetchone()[0]:
+            cursor.execute(
+                f"ALTER TABLE {table} ADD COLUMN slot SMALLINT NOT NULL DEFAULT 0, "
+                f"DROP PRIMARY KEY, ADD PRIMARY KEY ({key})"
+            )
+
+def create_revoked_tokens_table(cursor):
+    """
+    Create the 'revoked_tokens' table if it does not exist.
+
+    Fields:
+    - jti: Primary key, the unique id of a revoked refresh token.
+    - expires_at: UTC time the token expires; the row can be deleted afterwards.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS revoked_tokens (
+            jti VARCHAR(36) PRIMARY KEY,
+            expires_at DATETIME NOT NULL,
+            INDEX (expires_at)
+        )
+    """)
+
+# MySQL named lock (server-wide, hence the database name) held while the schema is created or migrated
+SCHEMA_LOCK = f"{Config.MYSQL_DB}-schema"
+
 def init_db(app):
     """
     Initialize the MySQL database by creating required tables.
 
     Steps:
-    1. Initialize the MySQL instance with the Flask app.
-    2. Use the app's context to access the MySQL connection.
-    3. Create all necessary tables (users, stations, trains, train stops, tickets, transactions).
-    4. Commit the changes and close the cursor.
+    1. Use the app's context to access the MySQL connection.
+    2. Take the `SCHEMA_LOCK` named lock, so processes starting at the same time
+       (e.g. `uvicorn --workers N`) set up the schema one after the other.
+    3. Create all necessary tables (users, stations, trains, train stops, tickets, transactions,
+       timetable version and change log, reporting rollups, revoked tokens) and add
+       columns missing from older schemas.
+    4. Commit the changes, release the lock and close the cursor.
 
     Parameters:
-    - app: The Flask application instance.
+    - app: The Flask application instance, already bound to `mysql` by `create_app`.
     """
-    mysql.init_app(app)  # Bind the MySQL instance to the Flask app
-
     with app.app_context():  # Access the app context to use MySQL connection
         cursor = mysql.connection.cursor()  # Create a cursor to execute SQL queries
 
-        # Call the table creation functions to set up the database
-        create_users_table(cursor)
-        create_stations_table(cursor)
-        create_trains_table(cursor)
-        create_train_stops_table(cursor)
-        create_tickets_table(cursor)
-        create_transectionHistory_table(cursor)
-
-        # Commit changes to the database and close the cursor
-        mysql.connection.commit()
-        cursor.close()
+        # The migrations check for a column and then ALTER the table, which is only
+        # safe while no other process does the same
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (SCHEMA_LOCK, 300))
+        if cursor.fetchone()[0] != 1:
+            raise RuntimeError("Timed out waiting for another process to set up the database schema.")
+        try:
+            # Call the table creation functions to set up the database
+            create_users_table(cursor)
+            create_stations_table(cursor)
+            add_station_coordinates(cursor)
+            create_trains_table(cursor)
+            create_train_stops_table(cursor)
+            create_tickets_table(cursor)
+            add_ticket_service_date(cursor)
+            create_transectionHistory_table(cursor)
+            create_timetable_version_table(cursor)
+            create_timetable_changes_table(cursor)
+            create_ticket_sales_hourly_table(cursor)
+            create_wallet_funds_hourly_table(cursor)
+            add_rollup_slots(cursor)
+            create_revoked_tokens_table(cursor)
+
+            # Commit changes to the database
+            mysql.connection.commit()
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (SCHEMA_LOCK,))
+            cursor.close()
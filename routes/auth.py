@@ -1,5 +1,8 @@
 from flask import Blueprint, request, jsonify
-from services.auth_service import hash_password, verify_password, generate_token
+from flask_jwt_extended import jwt_required, get_jwt, get_jwt_identity
+from services.auth_service import (
+    hash_password, verify_password, generate_token, generate_refresh_token, revoked_tokens
+)
 from models import mysql
 
 auth_routes = Blueprint('auth', __name__)
@@ -52,7 +55,9 @@ def login():
     User Login Endpoint.
 
     This endpoint allows users to log in by providing their email and password.
-    If the credentials are valid, a JWT access token is generated and returned.
+    If the credentials are valid, a JWT access token and a refresh token are returned.
+    Use the refresh token with `/token/refresh` to renew the access token instead of
+    logging in again.
 
     Request Body:
         - email (str): The email address of the user.
@@ -72,7 +77,8 @@ def login():
 
     Example Response:
         {
-            "access_token": "jwt_token_here"
+            "access_token": "jwt_token_here",
+            "refresh_token": "refresh_token_here"
         }
     """
     data = request.get_json()
@@ -85,7 +91,85 @@ def login():
     cursor.close()
 
     if user and verify_password(password, user[1]):
-        token = generate_token(user[0])
-        return jsonify(access_token=token), 200
+        return jsonify(
+            access_token=generate_token(user[0]),
+            refresh_token=generate_refresh_token(user[0])
+        ), 200
 
     return jsonify({"message": "Invalid credentials"}), 401
+
+@auth_routes.route('/token/refresh', methods=['POST'])
+@jwt_required(refresh=True)
+def refresh_token():
+
+    """
+    Token Refresh Endpoint.
+
+    This endpoint exchanges a refresh token for a new access token and a new refresh token,
+    without checking the password again. Refresh tokens rotate: the one sent is revoked and
+    cannot be used a second time.
+
+    Headers:
+        - Authorization (str): Bearer token in the format 'Bearer <refresh_token>'.
+
+    Responses:
+        - 200: New tokens returned successfully.
+        - 401: Refresh token missing, expired, or already used.
+
+    Example Request:
+        POST /token/refresh
+        Headers:
+            Authorization: Bearer <your_refresh_token>
+
+    Example Response:
+        {
+            "access_token": "jwt_token_here",
+            "refresh_token": "refresh_token_here"
+        }
+    """
+    claims = get_jwt()
+    user_id = get_jwt_identity()
+
+    cursor = mysql.connection.cursor()
+    rotated = revoked_tokens.revoke(cursor, claims['jti'], claims['exp'])
+    mysql.connection.commit()
+    cursor.close()
+
+    if not rotated:
+        return jsonify({"message": "Refresh token has already been used"}), 401
+
+    return jsonify(
+        access_token=generate_token(user_id),
+        refresh_token=generate_refresh_token(user_id)
+    ), 200
+
+@auth_routes.route('/logout', methods=['POST'])
+@jwt_required(refresh=True)
+def logout():
+
+    """
+    User Logout Endpoint.
+
+    This endpoint revokes the refresh token, so the session cannot be renewed.
+    Access tokens already issued stay valid until they expire (30 minutes).
+
+    Headers:
+        - Authorization (str): Bearer token in the format 'Bearer <refresh_token>'.
+
+    Responses:
+        - 200: Logged out successfully.
+        - 401: Refresh token missing, expired, or already revoked.
+
+    Example Response:
+        {
+            "message": "Logged out successfully"
+        }
+    """
+    claims = get_jwt()
+
+    cursor = mysql.connection.cursor()
+    revoked_tokens.revoke(cursor, claims['jti'], claims['exp'])
+    mysql.connection.commit()
+    cursor.close()
+
+    return jsonify({"message": "Logged out successfully"}), 200
@@ -0,0 +1,118 @@
+from datetime import datetime
+from flask import Blueprint, request, jsonify
+from models import mysql
+from flask_jwt_extended import jwt_required
+from services.report_service import SALES_GROUPS, funds_report, rebuild_rollups, sales_report
+
+report_routes = Blueprint('report', __name__)
+
+def _parse_range():
+    """
+    Read the optional `from` and `to` query parameters as datetimes.
+
+    Raises ValueError if either one is not an ISO 8601 date or datetime.
+    """
+    start = request.args.get('from')
+    end = request.args.get('to')
+    return (
+        datetime.fromisoformat(start) if start else None,
+        datetime.fromisoformat(end) if end else None
+    )
+
+@report_routes.route('/reports/sales', methods=['GET'])
+@jwt_required()
+def get_sales_report():
+    """
+    Retrieve tickets sold and revenue, grouped by train, route or hour.
+
+    The report is read from the hourly rollup table that every ticket purchase
+    updates, so it stays fast no matter how many tickets have been sold.
+    A valid JWT authentication token must be included in the request header.
+
+    Query Parameters:
+        - group_by (str, optional): 'train' (default), 'route' (origin-destination pair) or 'hour'.
+        - from (str, optional): Start of the period, inclusive, e.g. '2024-10-18' or '2024-10-18T06:00'.
+        - to (str, optional): End of the period, exclusive.
+
+    Headers:
+        - Authorization: Bearer <your_jwt_token>
+
+    Example Request:
+        GET /reports/sales?group_by=route&from=2024-10-18&to=2024-10-19
+
+    Example Response:
+        [
+            {
+                "from_station": 1,
+                "to_station": 2,
+                "tickets_sold": 120,
+                "revenue": 3000.0
+            }
+        ]
+
+    Response Codes:
+        - 200: Successfully retrieved the report.
+        - 400: Unknown group_by value or invalid date.
+    """
+    group_by = request.args.get('group_by', 'train')
+    if group_by not in SALES_GROUPS:
+        return jsonify({"message": f"group_by must be one of: {', '.join(SALES_GROUPS)}."}), 400
+    try:
+        start, end = _parse_range()
+    except ValueError:
+        return jsonify({"message": "from and to must be ISO 8601 dates."}), 400
+
+    cursor = mysql.connection.cursor()
+    report = sales_report(cursor, group_by, start, end)
+    cursor.close()
+
+    return jsonify(report), 200
+
+@report_routes.route('/reports/funds', methods=['GET'])
+@jwt_required()
+def get_funds_report():
+    """
+    Retrieve wallet top-ups per hour.
+
+    The report is read from the hourly rollup table that every `/wallet/add` updates.
+    A valid JWT authentication token must be included in the request header.
+
+    Query Parameters:
+        - from (str, optional): Start of the period, inclusive.
+        - to (str, optional): End of the period, exclusive.
+
+    Headers:
+        - Authorization: Bearer <your_jwt_token>
+
+    Example Response:
+        [
+            {
+                "hour": "2024-10-18 12:00:00",
+                "topups": 14,
+                "funds_added": 1400.5
+            }
+        ]
+
+    Response Codes:
+        - 200: Successfully retrieved the report.
+        - 400: Invalid date.
+    """
+    try:
+        start, end = _parse_range()
+    except ValueError:
+        return jsonify({"message": "from and to must be ISO 8601 dates."}), 400
+
+    cursor = mysql.connection.cursor()
+    report = funds_report(cursor, start, end)
+    cursor.close()
+
+    return jsonify(report), 200
+
+@report_routes.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recompute the reporting rollups from all tickets and transactions."""
+    cursor = mysql.connection.cursor()
+    rebuild_rollups(cursor)
+    mysql.connection.commit()
+    cursor.close()
+    print("Reporting rollups rebuilt.")
@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify
 from models import mysql
 from flask_jwt_extended import jwt_required
+from services.geo_index import parse_coordinates, station_locations
+from services.timetable_service import fetch_stations, record_change, record_station_change
 
 station_routes = Blueprint('station', __name__)
 
@@ -13,18 +15,21 @@ def add_station():
     Add a new station.
 
     This endpoint allows authenticated users to add a new station by providing its name and location.
+    Coordinates are optional; only stations with coordinates are returned by `/stations/nearby`.
     A valid JWT authentication token must be included in the request header.
 
     Request Body:
         - name (str): The name of the station.
         - location (str): The location of the station.
+        - latitude (float, optional): The station's latitude in degrees, within [-90, 90].
+        - longitude (float, optional): The station's longitude in degrees, within [-180, 180].
 
     Headers:
         - Authorization (str): Bearer token in the format 'Bearer <token>'.
 
     Responses:
         - 201: Station added successfully.
-        - 400: Bad request if name or location is missing.
+        - 400: Bad request if name or location is missing, or the coordinates are invalid.
         - 500: Internal server error if there is an issue with the database.
 
     Example Request:
@@ -34,7 +39,9 @@ def add_station():
         Body:
         {
             "name": "Station A",
-            "location": "Location A"
+            "location": "Location A",
+            "latitude": 23.7104,
+            "longitude": 90.4074
         }
 
     Example Response:
@@ -45,12 +52,28 @@ def add_station():
     data = request.get_json()
     name = data['name']
     location = data['location']
+    latitude = longitude = None
+    if data.get('latitude') is not None or data.get('longitude') is not None:
+        try:
+            latitude, longitude = parse_coordinates(data.get('latitude'), data.get('longitude'))
+        except ValueError as err:
+            return jsonify({"message": str(err)}), 400
 
     cursor = mysql.connection.cursor()
-    cursor.execute("INSERT INTO stations (name, location) VALUES (%s, %s)", (name, location))
+    cursor.execute(
+        "INSERT INTO stations (name, location, latitude, longitude) VALUES (%s, %s, %s, %s)",
+        (name, location, latitude, longitude)
+    )
+    station_id = cursor.lastrowid
+    record_change(cursor, 'station', station_id)
     mysql.connection.commit()
     cursor.close()
 
+    # Make the station searchable in this process right away
+    station_locations.upsert({
+        "id": station_id, "name": name, "location": location, "latitude": latitude, "longitude": longitude
+    })
+
     return jsonify({"message": "Station added successfully"}), 201
 
 
@@ -68,13 +91,15 @@ def update_station(station_id):
     Request Body:
         - name (str, optional): The new name of the station.
         - location (str, optional): The new location of the station.
+        - latitude (float, optional): The new latitude in degrees; must be sent with longitude.
+        - longitude (float, optional): The new longitude in degrees; must be sent with latitude.
 
     Headers:
         - Authorization (str): Bearer token in the format 'Bearer <token>'.
 
     Responses:
         - 200: Station updated successfully.
-        - 400: No valid fields provided for update.
+        - 400: No valid fields provided for update, or invalid coordinates.
         - 404: Station not found if the station ID is invalid.
         - 500: Internal server error if there is an issue with the database.
 
@@ -94,24 +119,37 @@ def update_station(station_id):
     """
     
     data = request.get_json()
-    name = data.get('name')  # Optional: Update only if provided
-    location = data.get('location')  # Optional: Update only if provided
+
+    # Collect only the provided fields
+    fields = {}
+    if data.get('name'):
+        fields['name'] = data['name']
+    if data.get('location'):
+        fields['location'] = data['location']
+    if data.get('latitude') is not None or data.get('longitude') is not None:
+        try:
+            fields['latitude'], fields['longitude'] = parse_coordinates(data.get('latitude'), data.get('longitude'))
+        except ValueError as err:
+            return jsonify({"message": str(err)}), 400
+    if not fields:
+        return jsonify({"message": "No valid fields provided for update."}), 400
 
     cursor = mysql.connection.cursor()
 
     # Dynamic SQL query to update only the provided fields
-    if name and location:
-        cursor.execute("UPDATE stations SET name = %s, location = %s WHERE id = %s", (name, location, station_id))
-    elif name:
-        cursor.execute("UPDATE stations SET name = %s WHERE id = %s", (name, station_id))
-    elif location:
-        cursor.execute("UPDATE stations SET location = %s WHERE id = %s", (location, station_id))
-    else:
-        return jsonify({"message": "No valid fields provided for update."}), 400
+    assignments = ", ".join(f"{column} = %s" for column in fields)
+    cursor.execute(f"UPDATE stations SET {assignments} WHERE id = %s", (*fields.values(), station_id))
 
+    station = None
+    if cursor.rowcount:
+        record_station_change(cursor, station_id, renamed='name' in fields)
+        station = fetch_stations(cursor, [station_id])[0]
     mysql.connection.commit()
     cursor.close()
 
+    if station is not None:
+        station_locations.upsert(station)
+
     return jsonify({"message": f"Station {station_id} updated successfully."}), 200
 
 
@@ -135,25 +173,88 @@ def get_all_stations():
             {
                 "id": 1,
                 "name": "Station A",
-                "location": "Location A"
+                "location": "Location A",
+                "latitude": 23.7104,
+                "longitude": 90.4074
             },
             {
                 "id": 2,
                 "name": "Station B",
-                "location": "Location B"
+                "location": "Location B",
+                "latitude": null,
+                "longitude": null
             }
         ]
     """
     
     cursor = mysql.connection.cursor()
-    cursor.execute("SELECT id, name, location FROM stations")
-    stations = cursor.fetchall()
+    station_list = fetch_stations(cursor)
     cursor.close()
 
-    # Format the result as a list of dictionaries
-    station_list = [
-        {"id": station[0], "name": station[1], "location": station[2]}
-        for station in stations
-    ]
-
     return jsonify(station_list), 200
+
+
+@station_routes.route('/stations/nearby', methods=['GET'])
+def get_nearby_stations():
+    """
+    Retrieve the stations closest to a point.
+
+    Stations are searched in an in-memory spatial index that follows the
+    timetable change log, so the lookup does not scan the 'stations' table.
+    Distances are great-circle distances in kilometres. Stations without
+    coordinates are never returned.
+
+    Query Parameters:
+        - lat (float): Latitude of the point in degrees, within [-90, 90].
+        - lon (float): Longitude of the point in degrees, within [-180, 180].
+        - k (int, optional): Number of stations to return, 1 to 100. Defaults to 5.
+
+    Responses:
+        - 200: The nearest stations, closest first.
+        - 400: Missing or invalid lat, lon or k.
+        - 500: Internal server error if there is an issue with the database.
+
+    Example Request:
+        GET /stations/nearby?lat=23.75&lon=90.39&k=2
+
+    Example Response:
+        [
+            {
+                "id": 1,
+                "name": "Station A",
+                "location": "Location A",
+                "latitude": 23.7104,
+                "longitude": 90.4074,
+                "distance_km": 4.746
+            },
+            {
+                "id": 3,
+                "name": "Station C",
+                "location": "Location C",
+                "latitude": 23.8103,
+                "longitude": 90.4125,
+                "distance_km": 7.085
+            }
+        ]
+    """
+    try:
+        latitude, longitude = parse_coordinates(request.args.get('lat'), request.args.get('lon'))
+    except ValueError:
+        return jsonify({"message": "lat must be within [-90, 90] and lon within [-180, 180]."}), 400
+    try:
+        k = int(request.args.get('k', 5))
+    except ValueError:
+        k = 0
+    if not 1 <= k <= 100:
+        return jsonify({"message": "k must be an integer between 1 and 100."}), 400
+
+    # Between syncs the index answers from memory, without touching the database
+    if station_locations.needs_sync():
+        cursor = mysql.connection.cursor()
+        station_locations.sync(cursor)
+        cursor.close()
+
+    return jsonify([
+        {**station, "distance_km": round(distance, 3)}
+        for distance, station in station_locations.nearest(latitude, longitude, k)
+    ]), 200
@@ -1,9 +1,44 @@
+from datetime import date
 from flask import Blueprint, request, jsonify
+from MySQLdb import IntegrityError
+from config import Config
 from models import mysql
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from services.report_service import record_ticket_sales
+from services.ticket_signing import InvalidTicket, TicketSigner
 
 ticket_routes = Blueprint('ticket', __name__)
 
+# Signs tickets at purchase and verifies them at the gates without the database
+ticket_signer = TicketSigner(Config.TICKET_SIGNING_KEY, Config.TICKET_GRACE_HOURS, Config.TICKET_REVOCATION_REFRESH)
+
+def _service_date(value):
+    """Parse an optional 'YYYY-MM-DD' service date, defaulting to today. Raises ValueError."""
+    return date.fromisoformat(value) if value else date.today()
+
+def _ticket_fields(ticket):
+    """
+    Validate one requested ticket before anything is written.
+
+    Returns (train_id, from_station, to_station, price, service_date), or raises
+    ValueError with a message for the client.
+    """
+    try:
+        price = float(ticket['price'])
+        train_id, from_station, to_station = ticket['train_id'], ticket['from_station'], ticket['to_station']
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Ticket must have train_id, from_station, to_station and price.")
+    if not 0 < price < float('inf'):  # Also rejects NaN
+        raise ValueError("Ticket must have a positive price.")
+    try:
+        service_date = _service_date(ticket.get('service_date'))
+    except (TypeError, ValueError):
+        raise ValueError("service_date must be in 'YYYY-MM-DD' format.")
+    train_id, from_station, to_station, service_date = ticket_signer.check(
+        train_id, from_station, to_station, service_date
+    )
+    return train_id, from_station, to_station, price, service_date
+
 @ticket_routes.route('/tickets/purchase', methods=['POST'])
 @jwt_required()
 def purchase_ticket():
@@ -11,20 +46,24 @@ def purchase_ticket():
     Purchase a ticket using wallet balance.
 
     This endpoint allows authenticated users to purchase a train ticket using their wallet balance.
+    The response contains a signed ticket token that gates check with `/tickets/validate`.
     A valid JWT authentication token must be included in the request header.
 
     Request Body:
         - train_id (int): The ID of the train for which the ticket is being purchased.
-        - from_station (str): The starting station of the journey.
-        - to_station (str): The destination station of the journey.
+        - from_station (int): The ID of the starting station of the journey.
+        - to_station (int): The ID of the destination station of the journey.
         - price (float): The price of the ticket.
+        - service_date (str, optional): The travel date in 'YYYY-MM-DD' format, defaults to today.
+          It is stored with the ticket and signed into the token.
 
     Headers:
         - Authorization (str): Bearer token in the format 'Bearer <token>'.
 
     Responses:
         - 200: Ticket purchased successfully.
-        - 400: Insufficient funds if the user's wallet balance is less than the ticket price.
+        - 400: Insufficient funds if the user's wallet balance is less than the ticket price,
+               invalid ticket fields or service date, or an unknown train or station.
         - 500: Internal server error if there is an issue with the database.
 
     Example Request:
@@ -34,39 +73,242 @@ def purchase_ticket():
         Body:
         {
             "train_id": 1,
-            "from_station": "Station A",
-            "to_station": "Station B",
+            "from_station": 1,
+            "to_station": 2,
             "price": 25.0
         }
 
     Example Response:
         {
-            "message": "Ticket purchased successfully."
+            "message": "Ticket purchased successfully.",
+            "ticket": "AQAAAAwAAAADAAAAAQAAAAJRCWrXA2BqkXzXE7LjqzAgNvwyOpV9"
         }
     """
     
     user_id = get_jwt_identity()
-    data = request.get_json()
-    train_id = data['train_id']
-    from_station = data['from_station']
-    to_station = data['to_station']
-    price = data['price']
+    try:
+        train_id, from_station, to_station, price, service_date = _ticket_fields(request.get_json() or {})
+    except ValueError as err:
+        return jsonify({"message": str(err)}), 400
 
     cursor = mysql.connection.cursor()
-    cursor.execute("SELECT wallet_balance FROM users WHERE id = %s", (user_id,))
-    balance = cursor.fetchone()[0]
-
-    if balance < price:
-        return jsonify({"message": "Insufficient funds."}), 400
-
-    # Deduct the amount and record the transaction
-    cursor.execute("UPDATE users SET wallet_balance = wallet_balance - %s WHERE id = %s", (price, user_id))
-    cursor.execute("""
-        INSERT INTO tickets (user_id, train_id, from_station, to_station, price)
-        VALUES (%s, %s, %s, %s, %s)
-    """, (user_id, train_id, from_station, to_station, price))
-    cursor.execute("INSERT INTO transactions (user_id, amount, type) VALUES (%s, %s, 'deduct')", (user_id, price))
-    mysql.connection.commit()
-    cursor.close()
-
-    return jsonify({"message": "Ticket purchased successfully."}), 200
+    try:
+        cursor.execute("SELECT wallet_balance FROM users WHERE id = %s FOR UPDATE", (user_id,))
+        balance = cursor.fetchone()[0]
+
+        if balance < price:
+            mysql.connection.rollback()
+            return jsonify({"message": "Insufficient funds."}), 400
+
+        # Deduct the amount and record the transaction
+        cursor.execute("UPDATE users SET wallet_balance = wallet_balance - %s WHERE id = %s", (price, user_id))
+        cursor.execute("""
+            INSERT INTO tickets (user_id, train_id, from_station, to_station, price, service_date)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, (user_id, train_id, from_station, to_station, price, service_date))
+        ticket_id = cursor.lastrowid
+        cursor.execute("INSERT INTO transactions (user_id, amount, type) VALUES (%s, %s, 'deduct')", (user_id, price))
+        record_ticket_sales(cursor, user_id, [(train_id, from_station, to_station, price)])
+
+        # Sign before committing, so the purchase is rolled back if no ticket can be issued
+        ticket = ticket_signer.sign(ticket_id, train_id, from_station, to_station, service_date)
+        mysql.connection.commit()
+    except IntegrityError:
+        mysql.connection.rollback()
+        return jsonify({"message": "Unknown train or station."}), 400
+    except Exception:
+        mysql.connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    return jsonify({"message": "Ticket purchased successfully.", "ticket": ticket}), 200
+
+@ticket_routes.route('/tickets/checkout', methods=['POST'])
+@jwt_required()
+def checkout_tickets():
+    """
+    Purchase several tickets at once in a single transaction.
+
+    All tickets are validated first, the wallet is debited once for the total,
+    and every ticket and its matching transaction are written with multi-row
+    inserts in one commit. Either all tickets are purchased or none are.
+    A valid JWT authentication token must be included in the request header.
+
+    Request Body:
+        - tickets (list): The tickets to purchase, each containing:
+            - train_id (int): The ID of the train.
+            - from_station (int): The ID of the starting station.
+            - to_station (int): The ID of the destination station.
+            - price (float): The price of the ticket.
+            - service_date (str, optional): The travel date in 'YYYY-MM-DD' format, defaults to today.
+              It is stored with the ticket and signed into its token.
+
+    Headers:
+        - Authorization (str): Bearer token in the format 'Bearer <token>'.
+
+    Responses:
+        - 200: All tickets purchased successfully, with a signed ticket token for each.
+        - 400: Invalid cart, unknown train or station, or insufficient funds.
+        - 500: Internal server error if there is an issue with the database.
+
+    Example Request:
+        POST /tickets/checkout
+        Headers:
+            Authorization: Bearer <your_jwt_token>
+        Body:
+        {
+            "tickets": [
+                {"train_id": 1, "from_station": 1, "to_station": 2, "price": 25.0},
+                {"train_id": 1, "from_station": 1, "to_station": 2, "price": 12.5}
+            ]
+        }
+
+    Example Response:
+        {
+            "message": "2 tickets purchased successfully.",
+            "total": 37.5,
+            "tickets": ["<signed_ticket_token>", "<signed_ticket_token>"]
+        }
+    """
+    user_id = get_jwt_identity()
+    tickets = (request.get_json() or {}).get('tickets')
+
+    if not isinstance(tickets, list) or not tickets:
+        return jsonify({"message": "tickets must be a non-empty list."}), 400
+
+    sales = []
+    service_dates = []
+    for index, ticket in enumerate(tickets):
+        try:
+            *sale, service_date = _ticket_fields(ticket if isinstance(ticket, dict) else {})
+        except ValueError as err:
+            return jsonify({"message": f"Ticket {index}: {err}"}), 400
+        sales.append(tuple(sale))
+        service_dates.append(service_date)
+    total = sum(sale[3] for sale in sales)
+
+    cursor = mysql.connection.cursor()
+    try:
+        # Lock the user's row so concurrent purchases cannot overspend the balance
+        cursor.execute("SELECT wallet_balance FROM users WHERE id = %s FOR UPDATE", (user_id,))
+        balance = cursor.fetchone()[0]
+
+        if balance < total:
+            mysql.connection.rollback()
+            return jsonify({"message": "Insufficient funds."}), 400
+
+        # Remember the user's latest ticket to find the ids of the new ones afterwards;
+        # the row lock above keeps other purchases for this user out until commit
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM tickets WHERE user_id = %s", (user_id,))
+        last_ticket_id = cursor.fetchone()[0]
+
+        # Deduct the total once and record every ticket and transaction
+        cursor.execute("UPDATE users SET wallet_balance = wallet_balance - %s WHERE id = %s", (total, user_id))
+        cursor.executemany("""
+            INSERT INTO tickets (user_id, train_id, from_station, to_station, price, service_date)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, [(user_id, *sale, service_date) for sale, service_date in zip(sales, service_dates)])
+        cursor.execute(
+            "SELECT id FROM tickets WHERE user_id = %s AND id > %s ORDER BY id",
+            (user_id, last_ticket_id)
+        )
+        ticket_ids = [row[0] for row in cursor.fetchall()]
+        cursor.executemany(
+            "INSERT INTO transactions (user_id, amount, type) VALUES (%s, %s, %s)",
+            [(user_id, sale[3], 'deduct') for sale in sales]
+        )
+        record_ticket_sales(cursor, user_id, sales)
+
+        # Sign before committing, so the purchase is rolled back if no ticket can be issued
+        signed = [
+            ticket_signer.sign(ticket_id, train_id, from_station, to_station, service_date)
+            for ticket_id, (train_id, from_station, to_station, _), service_date
+            in zip(ticket_ids, sales, service_dates)
+        ]
+        mysql.connection.commit()
+    except IntegrityError:
+        mysql.connection.rollback()
+        return jsonify({"message": "Unknown train or station in cart."}), 400
+    except Exception:
+        mysql.connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    return jsonify({
+        "message": f"{len(sales)} tickets purchased successfully.",
+        "total": total,
+        "tickets": signed
+    }), 200
+
+@ticket_routes.route('/tickets/validate', methods=['POST'])
+def validate_ticket():
+    """
+    Validate a signed ticket at a gate.
+
+    The ticket's signature, expiry and revocation are checked in memory, without
+    querying the database, so gates can validate passengers at rush-hour rates.
+    Tickets marked invalid in the database (e.g. by `expire_tickets`) are revoked:
+    their ids are reloaded at most every `TICKET_REVOCATION_REFRESH` seconds.
+    No JWT is needed: the signed ticket is the credential.
+
+    Request Body:
+        - ticket (str): The ticket token returned at purchase.
+        - station_id (int, optional): The gate's station. If given, the ticket is only
+          valid at its origin or destination station.
+
+    Responses:
+        - 200: The ticket is valid.
+        - 400: station_id is not an integer.
+        - 403: The ticket is malformed, forged, expired, revoked, or for another station.
+
+    Example Request:
+        POST /tickets/validate
+        Body:
+        {
+            "ticket": "AQAAAAwAAAADAAAAAQAAAAJRCWrXA2BqkXzXE7LjqzAgNvwyOpV9",
+            "station_id": 1
+        }
+
+    Example Response:
+        {
+            "valid": true,
+            "ticket_id": 12,
+            "train_id": 3,
+            "from_station": 1,
+            "to_station": 2,
+            "service_date": "2024-10-18"
+        }
+    """
+    data = request.get_json(silent=True) or {}
+
+    station_id = data.get('station_id')
+    if station_id is not None:
+        try:
+            # Through str() so that 1.5 or True are rejected instead of truncated
+            station_id = int(str(station_id))
+        except ValueError:
+            return jsonify({"message": "station_id must be an integer."}), 400
+
+    if ticket_signer.revocations_stale():
+        cursor = mysql.connection.cursor()
+        ticket_signer.load_revoked(cursor)
+        cursor.close()
+
+    try:
+        ticket = ticket_signer.verify(data.get('ticket', ''))
+    except InvalidTicket as err:
+        return jsonify({"valid": False, "reason": str(err)}), 403
+
+    if station_id is not None and station_id not in (ticket.from_station, ticket.to_station):
+        return jsonify({"valid": False, "reason": "Ticket is not valid at this station."}), 403
+
+    return jsonify({
+        "valid": True,
+        "ticket_id": ticket.ticket_id,
+        "train_id": ticket.train_id,
+        "from_station": ticket.from_station,
+        "to_station": ticket.to_station,
+        "service_date": ticket.service_date.isoformat()
+    }), 200
@@ -1,9 +1,20 @@
-from flask import Blueprint, request, jsonify
-from models import mysql
+from flask import Blueprint, Response, request, jsonify
+from config import Config
+from models import mysql, get_mysql_connection
 from flask_jwt_extended import jwt_required
+from services.schedule_events import schedule_events
+from services.schedule_validation import check_stop_order, find_conflicts, to_seconds
+from services.timetable_snapshot import timetable_snapshot
+from services.timetable_service import (
+    fetch_train_schedules, get_changes_since, get_current_version, lock_timetable_version, record_change
+)
 
 train_routes = Blueprint('train', __name__)
 
+def _seconds_or_none(value):
+    # Stored stop times may be NULL, e.g. the arrival at a train's first stop
+    return to_seconds(value) if value is not None else None
+
 @train_routes.route('/trains', methods=['POST'])
 @jwt_required()
 def create_train():
@@ -43,20 +54,46 @@ def create_train():
             "message": "Train and stops added successfully."
         }
 
+    Validation:
+        - Stop times must be in order: each stop departs after it arrives, and arrives
+          after the previous stop departs.
+        - A stop must not overlap the dwell windows of more trains at the same station
+          than it has platforms (`STATION_PLATFORMS`). Depending on
+          `SCHEDULE_CONFLICT_MODE`, conflicts are rejected ('reject') or returned as
+          `warnings` in the response ('warn').
+
     Response Codes:
         - 201: Train and stops added successfully.
-        - 400: Bad request if the input data is invalid.
+        - 400: Bad request if the input data is invalid or stop times are out of order.
+        - 409: The stops conflict with existing trains (in 'reject' mode).
     """
 
     data = request.get_json()
     train_name = data['name']
     description = data.get('description', '')
+    stops = data['stops']
+
+    try:
+        windows = [
+            (stop['station_id'], to_seconds(stop['arrival_time']), to_seconds(stop['departure_time']))
+            for stop in stops
+        ]
+    except ValueError as err:
+        return jsonify({"message": str(err)}), 400
+    errors = check_stop_order([(arrival, departure) for _, arrival, departure in windows])
+    if errors:
+        return jsonify({"message": "Stop times are not in order.", "errors": errors}), 400
 
     cursor = mysql.connection.cursor()
+    conflicts = find_conflicts(cursor, windows)
+    if conflicts and Config.SCHEDULE_CONFLICT_MODE == 'reject':
+        mysql.connection.rollback()
+        cursor.close()
+        return jsonify({"message": "Stops conflict with existing trains.", "conflicts": conflicts}), 409
+
     cursor.execute("INSERT INTO trains (name, description) VALUES (%s, %s)", (train_name, description))
     train_id = cursor.lastrowid
 
-    stops = data['stops']
     for stop in stops:
         station_id = stop['station_id']
         arrival_time = stop['arrival_time']
@@ -66,9 +103,14 @@ def create_train():
             VALUES (%s, %s, %s, %s)
         """, (train_id, station_id, arrival_time, departure_time))
 
+    record_change(cursor, 'train', train_id)
     mysql.connection.commit()
     cursor.close()
-    return jsonify({"message": "Train and stops added successfully."}), 201
+
+    response = {"message": "Train and stops added successfully."}
+    if conflicts:
+        response["warnings"] = conflicts
+    return jsonify(response), 201
 
 @train_routes.route('/trains/<int:train_id>/stops/<int:stop_id>', methods=['PUT'])
 @jwt_required()
@@ -102,9 +144,15 @@ def update_train_stop(train_id, stop_id):
             "message": "Train stop updated successfully."
         }
 
+    The new times are validated like in `POST /trains`: the train's stops must stay in
+    order, and conflicts with other trains at the station are rejected or returned as
+    `warnings` depending on `SCHEDULE_CONFLICT_MODE`.
+
     Response Codes:
         - 200: Train stop updated successfully.
-        - 400: No valid fields provided for update.
+        - 400: No valid fields provided for update, or stop times out of order.
+        - 404: Train stop not found.
+        - 409: The new times conflict with other trains (in 'reject' mode).
     """
 
 
@@ -112,7 +160,57 @@ def update_train_stop(train_id, stop_id):
     arrival_time = data.get('arrival_time')
     departure_time = data.get('departure_time')
 
+    if not arrival_time and not departure_time:
+        return jsonify({"message": "No valid fields provided for update."}), 400
+
     cursor = mysql.connection.cursor()
+    # Lock the timetable version before reading anything, so the train's stops and the
+    # conflict index are read from a snapshot that includes every earlier change
+    lock_timetable_version(cursor)
+    cursor.execute("""
+        SELECT id, station_id, arrival_time, departure_time FROM train_stops
+        WHERE train_id = %s
+        ORDER BY arrival_time
+    """, (train_id,))
+    train_stops = cursor.fetchall()
+    current = next((stop for stop in train_stops if stop[0] == stop_id), None)
+    if current is None:
+        mysql.connection.rollback()
+        cursor.close()
+        return jsonify({"message": "Train stop not found."}), 404
+
+    _, station_id, old_arrival, old_departure = current
+    try:
+        # A time that is not updated keeps its stored value, which may be NULL
+        new_arrival = to_seconds(arrival_time) if arrival_time else _seconds_or_none(old_arrival)
+        new_departure = to_seconds(departure_time) if departure_time else _seconds_or_none(old_departure)
+    except ValueError as err:
+        mysql.connection.rollback()
+        cursor.close()
+        return jsonify({"message": str(err)}), 400
+
+    # Stops without both times (e.g. the first or last stop) have no dwell window to check
+    stop_times = [
+        (new_arrival, new_departure) if stop[0] == stop_id else (_seconds_or_none(stop[2]), _seconds_or_none(stop[3]))
+        for stop in train_stops
+    ]
+    errors = check_stop_order([times for times in stop_times if None not in times])
+    if errors:
+        mysql.connection.rollback()
+        cursor.close()
+        return jsonify({"message": "Stop times are not in order.", "errors": errors}), 400
+
+    conflicts = []
+    if new_arrival is not None and new_departure is not None:
+        replaced = []
+        if old_arrival is not None and old_departure is not None:
+            replaced.append((station_id, to_seconds(old_arrival), to_seconds(old_departure)))
+        conflicts = find_conflicts(cursor, [(station_id, new_arrival, new_departure)], replaced=replaced)
+    if conflicts and Config.SCHEDULE_CONFLICT_MODE == 'reject':
+        mysql.connection.rollback()
+        cursor.close()
+        return jsonify({"message": "Stop conflicts with other trains.", "conflicts": conflicts}), 409
+
     if arrival_time and departure_time:
         cursor.execute("""
             UPDATE train_stops SET arrival_time = %s, departure_time = %s 
@@ -122,16 +220,20 @@ def update_train_stop(train_id, stop_id):
         cursor.execute("""
             UPDATE train_stops SET arrival_time = %s WHERE id = %s AND train_id = %s
         """, (arrival_time, stop_id, train_id))
-    elif departure_time:
+    else:
         cursor.execute("""
             UPDATE train_stops SET departure_time = %s WHERE id = %s AND train_id = %s
         """, (departure_time, stop_id, train_id))
-    else:
-        return jsonify({"message": "No valid fields provided for update."}), 400
 
+    if cursor.rowcount:
+        record_change(cursor, 'train', train_id)
     mysql.connection.commit()
     cursor.close()
-    return jsonify({"message": "Train stop updated successfully."}), 200
+
+    response = {"message": "Train stop updated successfully."}
+    if conflicts:
+        response["warnings"] = conflicts
+    return jsonify(response), 200
 
 @train_routes.route('/trains', methods=['GET'])
 def get_all_train_schedules():
@@ -139,6 +241,13 @@ def get_all_train_schedules():
     Retrieve all train schedules, including stops and timings.
 
     This endpoint returns a list of all trains and their respective stops with arrival and departure times.
+    The current timetable version is returned in the `X-Timetable-Version` header.
+
+    Query Parameters:
+        - since (int, optional): The timetable version the client already has. When given,
+          only trains and stations changed after that version are returned, together with
+          the new version. If the change log no longer reaches back to `since`, a full
+          snapshot is returned and `full` is set to true.
 
     Example Request:
         GET /trains
@@ -166,37 +275,96 @@ def get_all_train_schedules():
             }
         ]
 
+    Example Request:
+        GET /trains?since=41
+
+    Example Response:
+        {
+            "version": 42,
+            "full": false,
+            "trains": [{"id": 1, "name": "Express Train", "description": "Fast train service", "stops": [...]}],
+            "stations": []
+        }
+
     Response Codes:
         - 200: Successfully retrieved train schedules.
         - 500: Internal server error if something goes wrong.
     """
+    since = request.args.get('since', type=int)
+
     cursor = mysql.connection.cursor()
-    cursor.execute("""
-        SELECT t.id, t.name, t.description, ts.station_id, s.name AS station_name, 
-               ts.arrival_time, ts.departure_time
-        FROM trains t
-        JOIN train_stops ts ON t.id = ts.train_id
-        JOIN stations s ON ts.station_id = s.id
-        ORDER BY t.id, ts.arrival_time
-    """)
-    results = cursor.fetchall()
+    if since is not None:
+        changes = get_changes_since(cursor, since)
+        cursor.close()
+        return jsonify(changes), 200
+
+    version = get_current_version(cursor)
+    snapshot = timetable_snapshot.current()
+    if snapshot is not None and snapshot.version == version:
+        train_list = snapshot.train_schedules()  # Served from the shared snapshot, no join
+    else:
+        train_list = fetch_train_schedules(cursor)
     cursor.close()
 
-    train_schedules = {}
-    for row in results:
-        train_id, train_name, description, station_id, station_name, arrival, departure = row
-        if train_id not in train_schedules:
-            train_schedules[train_id] = {
-                "name": train_name,
-                "description": description,
-                "stops": []
-            }
-        train_schedules[train_id]["stops"].append({
-            "station_id": station_id,
-            "station_name": station_name,
-            "arrival_time": str(arrival),
-            "departure_time": str(departure)
-        })
-
-    train_list = [{"id": k, **v} for k, v in train_schedules.items()]
-    return jsonify(train_list), 200
+    return jsonify(train_list), 200, {"X-Timetable-Version": str(version)}
+
+@train_routes.route('/trains/stream', methods=['GET'])
+def stream_train_schedules():
+    """
+    Stream timetable changes as Server-Sent Events.
+
+    Every train created with `POST /trains`, every stop updated with
+    `PUT /trains/<train_id>/stops/<stop_id>` and every station change is pushed to
+    connected clients as it is committed. Each event carries the timetable version
+    as its `id`, so reconnecting clients resume from the `Last-Event-ID` header.
+    If a client falls too far behind, a `resync` event is sent and the client
+    should catch up with `GET /trains?since=<version>`.
+
+    Each open stream holds one server thread, so only `SCHEDULE_STREAM_MAX_THREADS`
+    streams are accepted per process here. For many subscribers, serve the app with
+    `uvicorn asgi:app`, where streams wait on the event loop instead.
+
+    Query Parameters:
+        - train_id (int, optional): Only send changes for this train.
+        - station_id (int, optional): Only send changes for trains stopping at, or
+          updates of, this station.
+
+    Headers:
+        - Last-Event-ID (optional): The last event id the client received.
+
+    Example Request:
+        GET /trains/stream?station_id=2
+
+    Example Response:
+        id: 42
+        event: train
+        data: {"version": 42, "train": {"id": 1, "name": "Express Train", "stops": [...]}}
+
+        : heartbeat
+
+    Response Codes:
+        - 200: Event stream opened.
+        - 503: All stream slots of this process are in use.
+    """
+    train_id = request.args.get('train_id', type=int)
+    station_id = request.args.get('station_id', type=int)
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+
+    # Each stream blocks this thread until the client disconnects, so cap them
+    if not schedule_events.acquire_thread():
+        return jsonify({"message": "Too many open streams, try again later."}), 503, {"Retry-After": "5"}
+    try:
+        schedule_events.ensure_feed(get_mysql_connection, Config.SCHEDULE_FEED_INTERVAL)
+    except Exception:
+        schedule_events.release_thread()
+        raise
+    events = schedule_events.listen(
+        last_event_id, train_id, station_id, heartbeat=Config.SCHEDULE_STREAM_HEARTBEAT
+    )
+
+    response = Response(events, mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # Stop reverse proxies from buffering the stream
+    })
+    response.call_on_close(schedule_events.release_thread)  # Runs when the client disconnects
+    return response
@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify
 from models import mysql
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from services.report_service import record_wallet_topup
+from services.wallet_service import TRANSACTION_HISTORY_QUERY, format_transactions
 
 wallet_routes = Blueprint('wallet', __name__)
 
@@ -47,6 +49,7 @@ def add_funds():
     cursor = mysql.connection.cursor()
     cursor.execute("UPDATE users SET wallet_balance = wallet_balance + %s WHERE id = %s", (amount, user_id))
     cursor.execute("INSERT INTO transactions (user_id, amount, type) VALUES (%s, %s, 'add')", (user_id, amount))
+    record_wallet_topup(cursor, user_id, amount)
     mysql.connection.commit()
     cursor.close()
 
@@ -94,14 +97,8 @@ def transaction_history():
     user_id = get_jwt_identity()
 
     cursor = mysql.connection.cursor()
-    cursor.execute("SELECT amount, type, timestamp FROM transactions WHERE user_id = %s ORDER BY timestamp DESC", (user_id,))
-    transactions = cursor.fetchall()
+    cursor.execute(TRANSACTION_HISTORY_QUERY, (user_id,))
+    transaction_list = format_transactions(cursor.fetchall())
     cursor.close()
 
-    # Format the transactions as a list of dictionaries
-    transaction_list = [
-        {"amount": amount, "type": trans_type, "timestamp": timestamp.strftime('%Y-%m-%d %H:%M:%S')}
-        for (amount, trans_type, timestamp) in transactions
-    ]
-
     return jsonify(transaction_list), 200
@@ -1,6 +1,9 @@
+import threading
+import uuid
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask_jwt_extended import create_access_token
-from datetime import timedelta
+from flask_jwt_extended import create_access_token, create_refresh_token
+from datetime import datetime, timedelta, timezone
+from config import Config
 
 def hash_password(password):
     return generate_password_hash(password)
@@ -10,3 +13,70 @@ def verify_password(password, hashed):
 
 def generate_token(user_id):
     return create_access_token(identity=user_id, expires_delta=timedelta(minutes=30))
+
+def generate_refresh_token(user_id):
+    return create_refresh_token(identity=user_id, expires_delta=timedelta(days=Config.REFRESH_TOKEN_DAYS))
+
+
+class RevokedTokens:
+    """
+    In-memory set of revoked refresh token ids, backed by the 'revoked_tokens' table.
+
+    Token ids are UUIDs and are kept as 16 raw bytes with their expiry, and
+    expired entries are dropped as the set grows. The database stays the
+    authority: `revoke` inserts the id under its primary key, so a refresh token
+    that another worker has already rotated is still rejected.
+    """
+
+    PRUNE_EVERY = 1024
+
+    def __init__(self):
+        self._expiries = {}
+        self._lock = threading.Lock()
+        self._added = 0
+
+    @staticmethod
+    def _key(jti):
+        try:
+            return uuid.UUID(jti).bytes
+        except ValueError:
+            return jti.encode()
+
+    def load(self, cursor):
+        """Replace the set with the unexpired revocations stored in the database."""
+        cursor.execute("SELECT jti, UNIX_TIMESTAMP(expires_at) FROM revoked_tokens WHERE expires_at > UTC_TIMESTAMP()")
+        expiries = {self._key(jti): int(expires) for jti, expires in cursor.fetchall()}
+        with self._lock:
+            self._expiries = expiries
+
+    def is_revoked(self, jti):
+        return self._key(jti) in self._expiries
+
+    def revoke(self, cursor, jti, expires):
+        """
+        Revoke the token `jti` that expires at Unix time `expires`.
+
+        Returns False if the token had already been revoked. The caller commits.
+        """
+        key = self._key(jti)
+        if key in self._expiries:
+            return False
+
+        cursor.execute(
+            "INSERT IGNORE INTO revoked_tokens (jti, expires_at) VALUES (%s, %s)",
+            (jti, datetime.fromtimestamp(expires, timezone.utc).replace(tzinfo=None))
+        )
+        newly_revoked = cursor.rowcount == 1
+
+        with self._lock:
+            self._expiries[key] = expires
+            self._added += 1
+            if self._added >= self.PRUNE_EVERY:
+                now = datetime.now(timezone.utc).timestamp()
+                self._expiries = {k: v for k, v in self._expiries.items() if v > now}
+                self._added = 0
+
+        return newly_revoked
+
+
+revoked_tokens = RevokedTokens()
@@ -0,0 +1,187 @@
+import math
+import threading
+import time
+from heapq import heappush, heapreplace
+
+from services.timetable_service import (
+    CHANGED_ENTITIES_QUERY, OLDEST_CHANGE_QUERY, fetch_stations, get_current_version, group_changes,
+    needs_full_sync
+)
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def _unit_vector(latitude, longitude):
+    latitude, longitude = math.radians(latitude), math.radians(longitude)
+    return (
+        math.cos(latitude) * math.cos(longitude),
+        math.cos(latitude) * math.sin(longitude),
+        math.sin(latitude)
+    )
+
+def _chord_to_km(chord_squared):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(chord_squared) / 2))
+
+
+def parse_coordinates(latitude, longitude):
+    """
+    Convert a latitude/longitude pair in degrees to floats.
+
+    Raises ValueError if either value is not a number or is out of range.
+    """
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        raise ValueError("latitude and longitude must be numbers.")
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError("latitude must be within [-90, 90] and longitude within [-180, 180].")
+    return latitude, longitude
+
+
+class StationKDTree:
+    """
+    In-memory k-d tree of station coordinates for k-nearest queries.
+
+    Stations are stored as points on the unit sphere, where the straight-line
+    (chord) distance grows with the great-circle distance. Searching the tree
+    by chord distance therefore returns the true nearest stations, with no
+    special cases at the poles or the antimeridian.
+
+    Writes are incremental: a changed station is marked stale in the tree and
+    kept in a small pending set that every query also scans. Once the pending
+    set grows past roughly the square root of the station count, the tree is
+    rebuilt from scratch.
+
+    The index is kept per process and follows the timetable change log: only
+    stations changed since the indexed version are reloaded.
+    """
+
+    def __init__(self, refresh_interval=5.0):
+        self.refresh_interval = refresh_interval
+        self.version = None
+        self._checked_at = 0.0
+        self._stations = {}
+        self._points = []  # (x, y, z, station_id) in tree order
+        self._nodes = []  # (left, right, axis, box_low, box_high) per point
+        self._root = -1
+        self._stale = set()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _build(self, points, axis=0):
+        if not points:
+            return -1
+        points.sort(key=lambda point: point[axis])
+        middle = len(points) // 2
+        index = len(self._points)
+        self._points.append(points[middle])
+        self._nodes.append(None)
+        left = self._build(points[:middle], (axis + 1) % 3)
+        right = self._build(points[middle + 1:], (axis + 1) % 3)
+        box_low = tuple(min(point[i] for point in points) for i in range(3))
+        box_high = tuple(max(point[i] for point in points) for i in range(3))
+        self._nodes[index] = (left, right, axis, box_low, box_high)
+        return index
+
+    def _rebuild(self):
+        points = [(*_unit_vector(s['latitude'], s['longitude']), station_id)
+                  for station_id, s in self._stations.items()]
+        self._points, self._nodes = [], []
+        self._root = self._build(points)
+        self._stale, self._pending = set(), {}
+
+    def upsert(self, station):
+        """Add or move a station dictionary with `id`, `latitude` and `longitude`."""
+        with self._lock:
+            station_id = station['id']
+            self._stale.add(station_id)
+            self._pending.pop(station_id, None)
+            self._stations.pop(station_id, None)
+            if station.get('latitude') is not None and station.get('longitude') is not None:
+                self._stations[station_id] = station
+                self._pending[station_id] = _unit_vector(station['latitude'], station['longitude'])
+            if len(self._stale) > max(64, math.isqrt(len(self._stations))):
+                self._rebuild()
+
+    def needs_sync(self):
+        """
+        Return True if the index has never been loaded or was last checked more
+        than `refresh_interval` seconds ago, so callers only open a connection
+        for `sync` when it will be used.
+        """
+        return self.version is None or time.monotonic() - self._checked_at >= self.refresh_interval
+
+    def sync(self, cursor, force=False):
+        """
+        Bring the index up to the current timetable version.
+
+        The database is consulted at most every `refresh_interval` seconds unless
+        `force` is set; in between, queries are answered from memory only.
+        """
+        if not force and not self.needs_sync():
+            return
+        self._checked_at = time.monotonic()
+
+        version = get_current_version(cursor)
+        if version == self.version:
+            return
+        cursor.execute(OLDEST_CHANGE_QUERY)
+        oldest = cursor.fetchone()[0]
+        if self.version is None or needs_full_sync(self.version, version, oldest):
+            stations = fetch_stations(cursor)
+            with self._lock:
+                self._stations = {
+                    station['id']: station for station in stations
+                    if station.get('latitude') is not None and station.get('longitude') is not None
+                }
+                self._rebuild()
+        else:
+            cursor.execute(CHANGED_ENTITIES_QUERY, (self.version, version))
+            changed = group_changes(cursor.fetchall())["station"]
+            for station in fetch_stations(cursor, changed):
+                self.upsert(station)
+        self.version = version
+
+    def nearest(self, latitude, longitude, k):
+        """
+        Return up to `k` (distance_km, station) pairs closest to the point, nearest first.
+        """
+        query = _unit_vector(latitude, longitude)
+        best = []  # Max-heap of the k nearest so far, as (-chord_squared, station_id)
+
+        def offer(point, station_id):
+            distance = sum((a - b) ** 2 for a, b in zip(point, query))
+            if len(best) < k:
+                heappush(best, (-distance, station_id))
+            elif distance < -best[0][0]:
+                heapreplace(best, (-distance, station_id))
+
+        with self._lock:
+            points, nodes, stale = self._points, self._nodes, self._stale
+
+            def search(index):
+                left, right, axis, box_low, box_high = nodes[index]
+                if len(best) == k:
+                    # Skip the subtree if its bounding box is farther than the k-th best
+                    gap = sum(max(low - q, 0.0, q - high) ** 2 for q, low, high in zip(query, box_low, box_high))
+                    if gap >= -best[0][0]:
+                        return
+                point = points[index]
+                if point[3] not in stale:
+                    offer(point[:3], point[3])
+                near, far = (left, right) if query[axis] < point[axis] else (right, left)
+                if near >= 0:
+                    search(near)
+                if far >= 0:
+                    search(far)
+
+            if self._root >= 0:
+                search(self._root)
+            for station_id, point in self._pending.items():
+                offer(point, station_id)
+
+            return [(_chord_to_km(-distance), self._stations[station_id])
+                    for distance, station_id in sorted(best, reverse=True)]
+
+
+station_locations = StationKDTree()
@@ -0,0 +1,214 @@
+"""
+On-demand request profiling and slow-query tracing.
+
+Every request is timed, together with each SQL statement it runs through a
+MySQLdb cursor. Requests or statements slower than `SLOW_REQUEST_MS` /
+`SLOW_QUERY_MS` are printed.
+
+A request is also profiled when it is picked by `PROFILE_SAMPLE_RATE` or sends
+an `X-Profile-Token` header matching `PROFILE_TOKEN`. A sampling thread then
+records the request thread's Python stack every `PROFILE_INTERVAL_MS`, and two
+files named after the `X-Profile-Id` response header are written to `PROFILE_DIR`:
+
+- `<id>.folded`: collapsed stacks, one `frame;frame;frame count` line per
+  distinct stack, for flamegraph.pl or speedscope.
+- `<id>.sql`: every SQL statement of the request with its duration.
+
+Only the newest `PROFILE_MAX_FILES` profiles are kept; older ones are deleted.
+"""
+import functools
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+import MySQLdb.cursors
+from flask import g, request
+
+from config import Config
+
+_local = threading.local()  # The current request's trace, per worker thread
+_installed = False
+
+
+def _statement_text(query):
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    return ' '.join(query.split())
+
+
+class StackSampler(threading.Thread):
+    """Samples one thread's Python call stack at a fixed interval until stopped."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._labels = {}
+        self._done = threading.Event()
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            filename = code.co_filename
+            if os.path.isabs(filename):
+                # Project files relative to the working directory, libraries as 'package/module.py'
+                relative = os.path.relpath(filename)
+                filename = relative if not relative.startswith('..') else os.path.join(*filename.split(os.sep)[-2:])
+            label = f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(';', ':')
+            self._labels[code] = label
+        return label
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+class RequestTrace:
+    """Timings collected for one request."""
+
+    def __init__(self, method, path, profile_id=None):
+        self.method = method
+        self.path = path
+        self.profile_id = profile_id
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.sql_ms = 0.0
+        self.queries = []  # (duration_ms, statement), only kept while profiling
+        self.in_query = False
+        self.sampler = None
+
+    def record_query(self, query, duration_ms, rows=None):
+        self.query_count += 1
+        self.sql_ms += duration_ms
+        if self.profile_id is None and duration_ms < Config.SLOW_QUERY_MS:
+            return
+        statement = _statement_text(query)
+        if rows is not None:
+            statement += f" /* executemany x {rows} */"
+        if self.profile_id is not None:
+            self.queries.append((duration_ms, statement))
+        if duration_ms >= Config.SLOW_QUERY_MS:
+            print(f"Slow query ({duration_ms:.1f} ms) in {self.method} {self.path}: {statement}")
+
+
+def _timed(method, many=False):
+    @functools.wraps(method)
+    def wrapper(cursor, query, args=None):
+        trace = getattr(_local, 'trace', None)
+        # executemany may call execute for each row; time only the outer call
+        if trace is None or trace.in_query:
+            return method(cursor, query, args)
+        trace.in_query = True
+        started = time.perf_counter()
+        try:
+            return method(cursor, query, args)
+        finally:
+            trace.in_query = False
+            rows = len(args) if many and hasattr(args, '__len__') else None
+            trace.record_query(query, (time.perf_counter() - started) * 1000, rows)
+    return wrapper
+
+def install_sql_timing():
+    """Time `execute` and `executemany` on every MySQLdb cursor (idempotent)."""
+    global _installed
+    if _installed:
+        return
+    cursor_class = MySQLdb.cursors.BaseCursor
+    cursor_class.execute = _timed(cursor_class.execute)
+    cursor_class.executemany = _timed(cursor_class.executemany, many=True)
+    _installed = True
+
+
+def _profile_requested():
+    token = request.headers.get('X-Profile-Token')
+    if token and Config.PROFILE_TOKEN and hmac.compare_digest(token.encode(), Config.PROFILE_TOKEN.encode()):
+        return True
+    return Config.PROFILE_SAMPLE_RATE > 0 and random.random() < Config.PROFILE_SAMPLE_RATE
+
+def _write_profile(trace):
+    os.makedirs(Config.PROFILE_DIR, exist_ok=True)
+    base = os.path.join(Config.PROFILE_DIR, trace.profile_id)
+    with open(base + '.folded', 'w') as folded_file:
+        for stack, count in trace.sampler.stacks.most_common():
+            folded_file.write(f"{stack} {count}\n")
+    with open(base + '.sql', 'w') as sql_file:
+        sql_file.write(f"# {trace.method} {trace.path}: {trace.query_count} queries, {trace.sql_ms:.2f} ms in SQL\n")
+        for duration_ms, statement in trace.queries:
+            sql_file.write(f"{duration_ms:10.2f} ms  {statement}\n")
+    _prune_profiles()
+
+def _prune_profiles():
+    # Keep the newest PROFILE_MAX_FILES profiles (two files each) across all workers
+    with os.scandir(Config.PROFILE_DIR) as entries:
+        files = [entry for entry in entries if entry.name.endswith(('.folded', '.sql')) and entry.is_file()]
+    excess = len(files) - 2 * Config.PROFILE_MAX_FILES
+    if excess <= 0:
+        return
+    files.sort(key=lambda entry: entry.name)  # Profile ids start with their timestamp
+    for entry in files[:excess]:
+        try:
+            os.unlink(entry.path)
+        except FileNotFoundError:  # Already removed by another worker
+            pass
+
+
+def init_profiling(app):
+    """Install the SQL timing and register the per-request profiling hooks on `app`."""
+    install_sql_timing()
+
+    @app.before_request
+    def start_trace():
+        profile_id = None
+        if _profile_requested():
+            slug = re.sub(r'[^A-Za-z0-9]+', '-', request.path).strip('-') or 'root'
+            profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{request.method}-{slug}-{uuid.uuid4().hex[:8]}"
+        trace = RequestTrace(request.method, request.path, profile_id)
+        if profile_id is not None:
+            trace.sampler = StackSampler(threading.get_ident(), Config.PROFILE_INTERVAL_MS / 1000)
+            trace.sampler.start()
+        _local.trace = g.request_trace = trace
+
+    @app.after_request
+    def add_profile_header(response):
+        trace = g.get('request_trace')
+        if trace is not None and trace.profile_id is not None:
+            response.headers['X-Profile-Id'] = trace.profile_id
+        return response
+
+    @app.teardown_request
+    def finish_trace(exc):
+        trace = g.pop('request_trace', None)
+        _local.trace = None
+        if trace is None:
+            return
+
+        elapsed_ms = (time.perf_counter() - trace.started) * 1000
+        if elapsed_ms >= Config.SLOW_REQUEST_MS:
+            print(
+                f"Slow request ({elapsed_ms:.1f} ms, {trace.query_count} queries, "
+                f"{trace.sql_ms:.1f} ms in SQL): {trace.method} {trace.path}"
+            )
+
+        if trace.sampler is not None:
+            trace.sampler.stop()
+            try:
+                _write_profile(trace)
+            except OSError as err:
+                print(f"Error writing profile {trace.profile_id}: {err}")
@@ -0,0 +1,135 @@
+from config import Config
+
+# Start of the current hour, computed by MySQL so buckets match the table timestamps
+CURRENT_HOUR = "TIMESTAMP(CURDATE(), MAKETIME(HOUR(NOW()), 0, 0))"
+
+# Each hourly total is split over `ROLLUP_SLOTS` rows picked by user id, so concurrent
+# purchases and top-ups by different users rarely wait on the same row lock.
+# Reports add the slots back up.
+def _slot(user_id):
+    return int(user_id) % Config.ROLLUP_SLOTS
+
+def record_ticket_sales(cursor, user_id, sales):
+    """
+    Add ticket sales to the hourly rollup in the caller's transaction.
+
+    Parameters:
+    - cursor: Cursor of the transaction that inserted the tickets.
+    - user_id: ID of the buyer, used to pick the rollup slot.
+    - sales: List of (train_id, from_station, to_station, price) tuples.
+    """
+    cursor.execute(f"SELECT {CURRENT_HOUR}")
+    hour = cursor.fetchone()[0]
+    slot = _slot(user_id)
+
+    # Only placeholders in VALUES, so the driver sends a single multi-row insert
+    cursor.executemany("""
+        INSERT INTO ticket_sales_hourly (hour, train_id, from_station, to_station, slot, tickets_sold, revenue)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            tickets_sold = tickets_sold + VALUES(tickets_sold),
+            revenue = revenue + VALUES(revenue)
+    """, [(hour, train_id, from_station, to_station, slot, 1, price)
+          for (train_id, from_station, to_station, price) in sales])
+
+def record_wallet_topup(cursor, user_id, amount):
+    """
+    Add a wallet top-up to the hourly rollup in the caller's transaction.
+    """
+    cursor.execute(f"""
+        INSERT INTO wallet_funds_hourly (hour, slot, topups, funds_added)
+        VALUES ({CURRENT_HOUR}, %s, 1, %s)
+        ON DUPLICATE KEY UPDATE topups = topups + 1, funds_added = funds_added + VALUES(funds_added)
+    """, (_slot(user_id), amount))
+
+def rebuild_rollups(cursor):
+    """
+    Recompute both rollup tables from 'tickets' and 'transactions'.
+
+    This scans the full tables and is only meant for backfilling existing data
+    or repairing the rollups, e.g. with `flask --app app report rebuild-rollups`.
+    """
+    hour_of = "TIMESTAMP(DATE({0}), MAKETIME(HOUR({0}), 0, 0))"
+
+    cursor.execute("DELETE FROM ticket_sales_hourly")
+    cursor.execute(f"""
+        INSERT INTO ticket_sales_hourly (hour, train_id, from_station, to_station, slot, tickets_sold, revenue)
+        SELECT {hour_of.format('timestamp')} AS sold_hour, train_id, from_station, to_station,
+               MOD(user_id, %s) AS user_slot, COUNT(*), SUM(price)
+        FROM tickets
+        GROUP BY sold_hour, train_id, from_station, to_station, user_slot
+    """, (Config.ROLLUP_SLOTS,))
+
+    cursor.execute("DELETE FROM wallet_funds_hourly")
+    cursor.execute(f"""
+        INSERT INTO wallet_funds_hourly (hour, slot, topups, funds_added)
+        SELECT {hour_of.format('timestamp')} AS added_hour, MOD(user_id, %s) AS user_slot, COUNT(*), SUM(amount)
+        FROM transactions
+        WHERE type = 'add'
+        GROUP BY added_hour, user_slot
+    """, (Config.ROLLUP_SLOTS,))
+
+# Dimensions the sales report can be grouped by, mapped to their rollup columns
+SALES_GROUPS = {
+    "train": ["train_id"],
+    "route": ["from_station", "to_station"],
+    "hour": ["hour"],
+}
+
+def sales_report(cursor, group_by, start=None, end=None):
+    """
+    Summarise ticket sales from the rollup table.
+
+    Parameters:
+    - group_by: One of `SALES_GROUPS` ('train', 'route' or 'hour').
+    - start, end: Optional datetime bounds, `start` inclusive and `end` exclusive.
+    """
+    columns = SALES_GROUPS[group_by]
+    where, params = _hour_range(start, end)
+    cursor.execute(f"""
+        SELECT {", ".join(columns)}, SUM(tickets_sold), SUM(revenue)
+        FROM ticket_sales_hourly
+        {where}
+        GROUP BY {", ".join(columns)}
+        ORDER BY {", ".join(columns)}
+    """, params)
+
+    report = []
+    for row in cursor.fetchall():
+        entry = {column: _json_value(value) for column, value in zip(columns, row)}
+        entry["tickets_sold"] = int(row[-2])
+        entry["revenue"] = float(row[-1])
+        report.append(entry)
+    return report
+
+def funds_report(cursor, start=None, end=None):
+    """
+    List hourly wallet top-ups from the rollup table.
+    """
+    where, params = _hour_range(start, end)
+    cursor.execute(f"""
+        SELECT hour, SUM(topups), SUM(funds_added) FROM wallet_funds_hourly
+        {where}
+        GROUP BY hour
+        ORDER BY hour
+    """, params)
+
+    return [
+        {"hour": _json_value(hour), "topups": int(topups), "funds_added": float(funds_added)}
+        for (hour, topups, funds_added) in cursor.fetchall()
+    ]
+
+def _hour_range(start, end):
+    conditions = []
+    params = []
+    if start is not None:
+        conditions.append("hour >= %s")
+        params.append(start)
+    if end is not None:
+        conditions.append("hour < %s")
+        params.append(end)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return where, tuple(params)
+
+def _json_value(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S') if hasattr(value, 'strftime') else value
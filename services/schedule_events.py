@@ -0,0 +1,266 @@
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+
+import mysql.connector
+
+from config import Config
+from services.timetable_service import fetch_stations, fetch_train_schedules, get_current_version
+
+
+class ScheduleEvent:
+    """
+    A timetable change ready to be sent to subscribers.
+
+    The Server-Sent Events frame is encoded once at publish time, so fanning an
+    event out to thousands of subscribers is only a socket write per subscriber.
+    """
+    __slots__ = ('id', 'train_id', 'station_ids', 'frame')
+
+    def __init__(self, event_id, event_type, data, train_id=None, station_ids=()):
+        self.id = event_id
+        self.train_id = train_id
+        self.station_ids = frozenset(station_ids)
+        self.frame = f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+    def matches(self, train_id=None, station_id=None):
+        if train_id is not None and self.train_id != train_id:
+            return False
+        if station_id is not None and station_id not in self.station_ids:
+            return False
+        return True
+
+
+class ScheduleEventHub:
+    """
+    In-process fan-out hub for timetable changes.
+
+    Events are kept in a single ring buffer ordered by timetable version. Each
+    subscriber only remembers the last version it sent, so publishing is O(1)
+    regardless of the number of subscribers and a slow client never blocks the
+    publisher or other subscribers. A subscriber that falls further behind than
+    the ring buffer holds receives a `resync` event and should catch up with
+    `GET /trains?since=<version>`.
+
+    Subscribers either block a thread (`listen`, for the Flask app) or wait on
+    the event loop (`alisten`, for the ASGI app). A blocked thread cannot serve
+    other requests, so at most `max_threads` thread subscribers are allowed per
+    process; the event loop has no such limit.
+    """
+
+    def __init__(self, capacity=1024, max_threads=4):
+        self._events = deque(maxlen=capacity)
+        self._condition = threading.Condition()
+        self._latest_id = 0
+        self._feed = None
+        self._feed_lock = threading.Lock()
+        self.max_threads = max_threads
+        self._threads = 0
+        self._loop_events = {}  # Event loop -> asyncio.Event set on the next publish
+
+    @property
+    def latest_id(self):
+        return self._latest_id
+
+    def reset(self, version):
+        """Start publishing after `version`, e.g. the timetable version at startup."""
+        with self._condition:
+            self._latest_id = max(self._latest_id, version)
+
+    def publish(self, event):
+        with self._condition:
+            self._events.append(event)
+            self._latest_id = event.id
+            self._condition.notify_all()
+            loops = list(self._loop_events)
+        for loop in loops:
+            try:
+                loop.call_soon_threadsafe(self._wake_loop, loop)
+            except RuntimeError:  # The loop has been closed
+                with self._condition:
+                    self._loop_events.pop(loop, None)
+
+    def _wake_loop(self, loop):
+        # Runs on `loop`: wake the current waiters and give later ones a fresh event
+        with self._condition:
+            event = self._loop_events.get(loop)
+            if event is not None:
+                self._loop_events[loop] = asyncio.Event()
+        if event is not None:
+            event.set()
+
+    def _loop_event(self):
+        loop = asyncio.get_running_loop()
+        with self._condition:
+            event = self._loop_events.get(loop)
+            if event is None:
+                event = self._loop_events[loop] = asyncio.Event()
+        return event
+
+    def _events_after(self, last_id):
+        # Events are ordered by id, so walk back from the newest one.
+        newer = []
+        for event in reversed(self._events):
+            if event.id <= last_id:
+                break
+            newer.append(event)
+        newer.reverse()
+        return newer
+
+    def _frames(self, batch, last_id, train_id, station_id):
+        frames = []
+        if not batch or batch[0].id > last_id + 1:
+            # The ring buffer no longer reaches back to the client's version.
+            frames.append(f"event: resync\ndata: {json.dumps({'since': last_id})}\n\n")
+        frames.extend(event.frame for event in batch if event.matches(train_id, station_id))
+        return frames
+
+    def acquire_thread(self):
+        """Reserve a thread subscriber slot. Returns False if all slots are in use."""
+        with self._condition:
+            if self._threads >= self.max_threads:
+                return False
+            self._threads += 1
+            return True
+
+    def release_thread(self):
+        with self._condition:
+            self._threads -= 1
+
+    def listen(self, last_id=None, train_id=None, station_id=None, heartbeat=15):
+        """
+        Yield Server-Sent Events frames for changes after `last_id`, blocking the
+        calling thread between events. Reserve a slot with `acquire_thread` first.
+
+        Parameters:
+        - last_id: Version from the client's `Last-Event-ID` header, or None to
+          start from the latest version.
+        - train_id, station_id: Optional filters.
+        - heartbeat: Seconds of silence after which a comment line is sent to
+          keep proxies and clients from timing out.
+        """
+        if last_id is None:
+            last_id = self._latest_id
+
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._latest_id > last_id, timeout=heartbeat)
+                latest_id = self._latest_id
+                batch = self._events_after(last_id)
+
+            if latest_id <= last_id:
+                yield ": heartbeat\n\n"
+                continue
+
+            yield from self._frames(batch, last_id, train_id, station_id)
+            last_id = latest_id
+
+    async def alisten(self, last_id=None, train_id=None, station_id=None, heartbeat=15):
+        """
+        Async version of `listen` for the ASGI app: waits on the event loop, so
+        one process can hold thousands of subscribers.
+        """
+        if last_id is None:
+            last_id = self._latest_id
+
+        while True:
+            if self._latest_id <= last_id:
+                waiter = self._loop_event()
+                if self._latest_id <= last_id:  # Re-check now that a publish will wake us
+                    try:
+                        await asyncio.wait_for(waiter.wait(), timeout=heartbeat)
+                    except asyncio.TimeoutError:
+                        yield ": heartbeat\n\n"
+                        continue
+
+            with self._condition:
+                latest_id = self._latest_id
+                batch = self._events_after(last_id)
+            for frame in self._frames(batch, last_id, train_id, station_id):
+                yield frame
+            last_id = latest_id
+
+    def ensure_feed(self, connect, interval=1.0):
+        """
+        Start the change log feed for this process if it is not running yet.
+
+        The current timetable version is read before returning, so the first
+        subscriber starts from it instead of seeing a spurious resync.
+        """
+        with self._feed_lock:
+            if self._feed is None or not self._feed.is_alive():
+                connection = connect()
+                connection.autocommit = True  # See new commits on every poll
+                cursor = connection.cursor(buffered=True)
+                self.reset(get_current_version(cursor))
+                cursor.close()
+                self._feed = ChangeLogFeed(self, connect, interval, connection=connection)
+                self._feed.start()
+
+
+class ChangeLogFeed(threading.Thread):
+    """
+    Background thread that publishes `timetable_changes` entries to a hub.
+
+    Polling the change log once per process (instead of publishing from the
+    request that made the change) delivers changes made by every worker, in
+    version order, to the subscribers of this worker.
+    """
+
+    def __init__(self, hub, connect, interval=1.0, batch_size=500, connection=None):
+        super().__init__(name='schedule-change-feed', daemon=True)
+        self.hub = hub
+        self.connect = connect
+        self.interval = interval
+        self.batch_size = batch_size
+        self.connection = connection
+
+    def run(self):
+        connection = self.connection
+        while True:
+            try:
+                if connection is None:
+                    connection = self.connect()
+                    connection.autocommit = True  # See new commits on every poll
+                cursor = connection.cursor(buffered=True)
+                self.poll(cursor)
+                cursor.close()
+            except mysql.connector.Error as err:
+                # Print error message and reconnect on the next poll
+                print(f"Error while polling timetable changes: {err}")
+                connection = None
+            time.sleep(self.interval)
+
+    def poll(self, cursor):
+        cursor.execute("""
+            SELECT version, entity, entity_id FROM timetable_changes
+            WHERE version > %s ORDER BY version LIMIT %s
+        """, (self.hub.latest_id, self.batch_size))
+        changes = cursor.fetchall()
+        if not changes:
+            return
+
+        train_ids = {entity_id for _, entity, entity_id in changes if entity == 'train'}
+        station_ids = {entity_id for _, entity, entity_id in changes if entity == 'station'}
+        trains = {train['id']: train for train in fetch_train_schedules(cursor, list(train_ids))}
+        stations = {station['id']: station for station in fetch_stations(cursor, list(station_ids))}
+
+        for version, entity, entity_id in changes:
+            if entity == 'train':
+                train = trains.get(entity_id)
+                stops = train['stops'] if train else []
+                self.hub.publish(ScheduleEvent(
+                    version, 'train', {"version": version, "train": train},
+                    train_id=entity_id,
+                    station_ids=[stop['station_id'] for stop in stops]
+                ))
+            else:
+                self.hub.publish(ScheduleEvent(
+                    version, 'station', {"version": version, "station": stations.get(entity_id)},
+                    station_ids=[entity_id]
+                ))
+
+
+schedule_events = ScheduleEventHub(Config.SCHEDULE_STREAM_BUFFER, Config.SCHEDULE_STREAM_MAX_THREADS)
@@ -0,0 +1,162 @@
+import threading
+from bisect import bisect_left, bisect_right, insort
+from datetime import timedelta
+
+from config import Config
+from services.timetable_service import (
+    CHANGED_ENTITIES_QUERY, OLDEST_CHANGE_QUERY, group_changes, lock_timetable_version, needs_full_sync
+)
+
+
+def to_seconds(value):
+    """
+    Convert a TIME value ('HH:MM', 'HH:MM:SS' or a timedelta from the driver) to seconds.
+
+    Raises ValueError for anything else.
+    """
+    if isinstance(value, timedelta):
+        return int(value.total_seconds())
+    try:
+        parts = [int(part) for part in str(value).split(':')]
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid time: {value}")
+    if len(parts) == 2:
+        parts.append(0)
+    if len(parts) != 3 or not (0 <= parts[1] < 60 and 0 <= parts[2] < 60) or parts[0] < 0:
+        raise ValueError(f"Invalid time: {value}")
+    return parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+def format_seconds(seconds):
+    return str(timedelta(seconds=seconds))
+
+
+def check_stop_order(stops):
+    """
+    Check that a train's stops are time-monotonic.
+
+    Parameters:
+    - stops: (arrival_seconds, departure_seconds) for each stop, in travel order.
+
+    Returns a list of error messages, empty if the sequence is valid.
+    """
+    errors = []
+    previous_departure = None
+    for position, (arrival, departure) in enumerate(stops):
+        if departure < arrival:
+            errors.append(f"Stop {position} departs before it arrives.")
+        if previous_departure is not None and arrival < previous_departure:
+            errors.append(f"Stop {position} arrives before the previous stop departs.")
+        previous_departure = departure
+    return errors
+
+
+class StationIntervalIndex:
+    """
+    Per-station index of the dwell windows in 'train_stops'.
+
+    For every station, the window starts and ends are kept in two sorted lists.
+    The windows overlapping [start, end] are those starting at or before `end`,
+    minus those ending before `start`, so counting them takes two binary
+    searches: O(log n) per stop.
+
+    The index is kept per process and follows the timetable change log: only
+    trains changed since the indexed version are reloaded.
+    """
+
+    def __init__(self):
+        self.version = None
+        self._starts = {}
+        self._ends = {}
+        self._train_windows = {}
+        self.lock = threading.Lock()
+
+    def _add(self, station_id, start, end):
+        insort(self._starts.setdefault(station_id, []), start)
+        insort(self._ends.setdefault(station_id, []), end)
+
+    def _remove(self, station_id, start, end):
+        starts, ends = self._starts[station_id], self._ends[station_id]
+        del starts[bisect_left(starts, start)]
+        del ends[bisect_left(ends, end)]
+
+    def _load_trains(self, cursor, train_ids=None):
+        query = "SELECT train_id, station_id, arrival_time, departure_time FROM train_stops"
+        params = ()
+        if train_ids is not None:
+            if not train_ids:
+                return
+            query += f" WHERE train_id IN ({', '.join(['%s'] * len(train_ids))})"
+            params = tuple(train_ids)
+            for train_id in train_ids:
+                for window in self._train_windows.pop(train_id, []):
+                    self._remove(*window)
+        cursor.execute(query, params)
+
+        for train_id, station_id, arrival, departure in cursor.fetchall():
+            if arrival is None or departure is None:
+                continue
+            window = (station_id, to_seconds(arrival), to_seconds(departure))
+            self._train_windows.setdefault(train_id, []).append(window)
+            self._add(*window)
+
+    def sync(self, cursor, version):
+        """Bring the index up to timetable `version` (caller holds `lock`)."""
+        if self.version == version:
+            return
+
+        cursor.execute(OLDEST_CHANGE_QUERY)
+        oldest = cursor.fetchone()[0]
+        if self.version is None or needs_full_sync(self.version, version, oldest):
+            self._starts, self._ends, self._train_windows = {}, {}, {}
+            self._load_trains(cursor)
+        else:
+            cursor.execute(CHANGED_ENTITIES_QUERY, (self.version, version))
+            self._load_trains(cursor, group_changes(cursor.fetchall())["train"])
+        self.version = version
+
+    def count_overlapping(self, station_id, start, end):
+        """Count indexed dwell windows at `station_id` that overlap [start, end]."""
+        starts = self._starts.get(station_id)
+        if not starts:
+            return 0
+        return bisect_right(starts, end) - bisect_left(self._ends[station_id], start)
+
+
+station_index = StationIntervalIndex()
+
+def find_conflicts(cursor, stops, replaced=()):
+    """
+    Find stops whose dwell window would exceed the station's platform count.
+
+    Locks the timetable version row until the caller commits or rolls back, so
+    concurrent writers cannot both pass validation and then overlap. The lock must
+    be taken before the transaction's first plain read (call this first, or call
+    `lock_timetable_version` first): otherwise the index is synced from an older
+    snapshot and misses changes committed in between.
+
+    Parameters:
+    - stops: (station_id, arrival_seconds, departure_seconds) for each new window.
+    - replaced: Windows, in the same format, that the change removes (e.g. the old
+      times of an updated stop). They are not counted as conflicts.
+
+    Returns a list of conflict messages, empty if all stops fit.
+    """
+    version = lock_timetable_version(cursor)
+    platforms = Config.STATION_PLATFORMS
+
+    conflicts = []
+    with station_index.lock:
+        station_index.sync(cursor, version)
+        for station_id, arrival, departure in stops:
+            occupied = station_index.count_overlapping(station_id, arrival, departure)
+            occupied -= sum(
+                1 for (old_station, old_arrival, old_departure) in replaced
+                if old_station == station_id and old_arrival <= departure and old_departure >= arrival
+            )
+            if occupied >= platforms:
+                conflicts.append(
+                    f"Station {station_id} already has {occupied} train(s) between "
+                    f"{format_seconds(arrival)} and {format_seconds(departure)} "
+                    f"({platforms} platform(s))."
+                )
+    return conflicts
@@ -0,0 +1,211 @@
+"""
+Compact signed tickets that gates can verify without the database.
+
+A ticket token is the URL-safe base64 encoding of a 23-byte payload followed by
+a 16-byte truncated HMAC-SHA256 of that payload (52 characters in total):
+
+    format version (1) | ticket id (4) | train id (4) | from station (4)
+    | to station (4) | service date as days since 1970-01-01 (2) | expiry as Unix time (4)
+
+This module only uses the standard library, so it can be copied to gate devices
+and run on its own:
+
+    TICKET_SIGNING_KEY=... python -m services.ticket_signing <token> [<token> ...]
+
+The signing key must never be the JWT secret, because gates hold a copy of it.
+When TICKET_SIGNING_KEY is not set, the app uses a key derived from
+JWT_SECRET_KEY with `derive_key`. The derived key cannot be used to recover the
+JWT secret. Print it for provisioning gates with:
+
+    JWT_SECRET_KEY=... python -m services.ticket_signing --derive-key
+"""
+import base64
+import binascii
+import calendar
+import hashlib
+import hmac
+import os
+import struct
+import sys
+import threading
+import time
+from collections import namedtuple
+from datetime import date, timedelta
+
+FORMAT_VERSION = 1
+PAYLOAD = struct.Struct('!BIIIIHI')
+MAC_SIZE = 16
+EPOCH = date(1970, 1, 1)
+
+def derive_key(secret):
+    """Return the ticket signing key derived from `secret` (the JWT secret), as hex."""
+    if isinstance(secret, str):
+        secret = secret.encode()
+    return hmac.new(secret, b'ticket-signing', hashlib.sha256).hexdigest()
+
+
+Ticket = namedtuple('Ticket', ['ticket_id', 'train_id', 'from_station', 'to_station', 'service_date', 'expires'])
+
+
+class InvalidTicket(ValueError):
+    """Raised when a ticket token is malformed, forged, expired or revoked."""
+
+
+class TicketSigner:
+    """
+    Signs and verifies ticket tokens with a shared secret key.
+
+    The keyed HMAC state is prepared once and copied for every token, so a
+    verification is a base64 decode, one HMAC block and a struct unpack, with
+    no I/O. Revoked ticket ids are kept in memory until their tickets expire;
+    `load_revoked` reloads them from the 'tickets' table, which stays the
+    authority, at most every `refresh_interval` seconds.
+    """
+
+    PRUNE_EVERY = 1024
+
+    def __init__(self, key, grace_hours=6, refresh_interval=30.0):
+        if isinstance(key, str):
+            key = key.encode()
+        self._mac = hmac.new(key, digestmod=hashlib.sha256)
+        self.grace = int(grace_hours * 3600)
+        self.refresh_interval = refresh_interval
+        self._revoked = {}
+        self._revoked_lock = threading.Lock()
+        self._revocations = 0
+        self._loaded_at = None
+
+    def _digest(self, payload):
+        mac = self._mac.copy()
+        mac.update(payload)
+        return mac.digest()[:MAC_SIZE]
+
+    def _expires(self, service_date):
+        return calendar.timegm((service_date + timedelta(days=1)).timetuple()) + self.grace
+
+    def check(self, train_id, from_station, to_station, service_date):
+        """
+        Convert the ticket fields to the types stored in a token.
+
+        Returns (train_id, from_station, to_station, service_date), or raises
+        ValueError if a field cannot be stored, so callers can reject a purchase
+        before writing anything.
+        """
+        try:
+            # Through str() so that 1.5 or True are rejected instead of truncated
+            ids = [int(str(value)) for value in (train_id, from_station, to_station)]
+        except (TypeError, ValueError):
+            raise ValueError("train_id, from_station and to_station must be integers.")
+        if not all(0 < value <= 0xFFFFFFFF for value in ids):
+            raise ValueError("train_id, from_station and to_station must be positive 32-bit integers.")
+        if not isinstance(service_date, date):
+            raise ValueError("service_date must be a date.")
+        if not (EPOCH <= service_date and (service_date - EPOCH).days <= 0xFFFF
+                and self._expires(service_date) <= 0xFFFFFFFF):
+            raise ValueError("service_date is out of range.")
+        return (*ids, service_date)
+
+    def sign(self, ticket_id, train_id, from_station, to_station, service_date):
+        """
+        Return a token for the ticket, valid until the end of `service_date` (UTC)
+        plus the grace period.
+
+        Raises ValueError for fields rejected by `check` or an invalid ticket id.
+        """
+        train_id, from_station, to_station, service_date = self.check(
+            train_id, from_station, to_station, service_date
+        )
+        if not 0 < ticket_id <= 0xFFFFFFFF:
+            raise ValueError("ticket_id must be a positive 32-bit integer.")
+        payload = PAYLOAD.pack(
+            FORMAT_VERSION, ticket_id, train_id, from_station, to_station,
+            (service_date - EPOCH).days, self._expires(service_date)
+        )
+        return base64.urlsafe_b64encode(payload + self._digest(payload)).decode('ascii')
+
+    def verify(self, token, now=None):
+        """
+        Check the token's signature, expiry and revocation and return its `Ticket`.
+
+        Raises InvalidTicket with the reason if the ticket must not be accepted.
+        """
+        try:
+            # Strict decoding: characters outside the alphabet are rejected, not skipped
+            raw = base64.b64decode(token, altchars=b'-_', validate=True)
+        except (binascii.Error, TypeError, ValueError):
+            raise InvalidTicket("Malformed ticket.")
+        # Only the canonical encoding is accepted (not '+' or '/' for '-' or '_'),
+        # so every ticket has exactly one valid token
+        if len(raw) != PAYLOAD.size + MAC_SIZE or base64.urlsafe_b64encode(raw).decode('ascii') != token:
+            raise InvalidTicket("Malformed ticket.")
+
+        payload, signature = raw[:PAYLOAD.size], raw[PAYLOAD.size:]
+        if not hmac.compare_digest(signature, self._digest(payload)):
+            raise InvalidTicket("Invalid signature.")
+
+        version, ticket_id, train_id, from_station, to_station, day, expires = PAYLOAD.unpack(payload)
+        if version != FORMAT_VERSION:
+            raise InvalidTicket("Unsupported ticket format.")
+        if (now if now is not None else time.time()) >= expires:
+            raise InvalidTicket("Ticket has expired.")
+        if ticket_id in self._revoked:
+            raise InvalidTicket("Ticket has been revoked.")
+
+        return Ticket(ticket_id, train_id, from_station, to_station, EPOCH + timedelta(days=day), expires)
+
+    def revocations_stale(self):
+        """Return True if the revoked ids have never been loaded or are older than `refresh_interval`."""
+        return self._loaded_at is None or time.monotonic() - self._loaded_at >= self.refresh_interval
+
+    def load_revoked(self, cursor):
+        """
+        Replace the revoked ids with the tickets marked invalid in the database
+        (`is_valid = FALSE`) whose tokens have not expired yet.
+
+        Tickets sold before their service date was stored are assumed to be for
+        their purchase date, the default.
+        """
+        self._loaded_at = time.monotonic()  # Other threads keep using the current set meanwhile
+        # Tokens for this date or later may still be within their grace period
+        oldest = EPOCH + timedelta(days=int((time.time() - self.grace) // 86400) - 1)
+        cursor.execute("""
+            SELECT id, COALESCE(service_date, DATE(timestamp)) FROM tickets
+            WHERE is_valid = FALSE AND COALESCE(service_date, DATE(timestamp)) >= %s
+        """, (oldest,))
+        revoked = {ticket_id: self._expires(service_date) for ticket_id, service_date in cursor.fetchall()}
+        with self._revoked_lock:
+            self._revoked = revoked
+            self._revocations = 0
+
+    def revoke(self, ticket_id, expires):
+        """
+        Reject `ticket_id` from now on. The entry is dropped once the ticket would
+        have expired anyway (`expires`, Unix time), or by the next `load_revoked`
+        unless the ticket is also marked invalid in the database.
+        """
+        with self._revoked_lock:
+            self._revoked[ticket_id] = expires
+            self._revocations += 1
+            if self._revocations >= self.PRUNE_EVERY:
+                now = time.time()
+                self._revoked = {k: v for k, v in self._revoked.items() if v > now}
+                self._revocations = 0
+
+
+def main(tokens):
+    if tokens == ['--derive-key']:
+        print(derive_key(os.environ['JWT_SECRET_KEY']))
+        return 0
+    signer = TicketSigner(os.environ['TICKET_SIGNING_KEY'], float(os.getenv('TICKET_GRACE_HOURS', 6)))
+    valid = True
+    for token in tokens:
+        try:
+            print(f"VALID   {signer.verify(token)}")
+        except InvalidTicket as err:
+            print(f"INVALID {err}")
+            valid = False
+    return 0 if valid else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,211 @@
+def _placeholders(values):
+    return ", ".join(["%s"] * len(values))
+
+def record_change(cursor, entity, entity_id):
+    """
+    Record a timetable mutation in the change log and return its version.
+
+    The version counter row stays locked until the caller commits, so two
+    writers can never commit their versions out of order.
+
+    Parameters:
+    - cursor: Cursor of the transaction that performed the mutation.
+    - entity: 'train' or 'station'.
+    - entity_id: ID of the changed train or station.
+    """
+    cursor.execute("UPDATE timetable_version SET version = LAST_INSERT_ID(version + 1) WHERE id = 1")
+    cursor.execute("SELECT LAST_INSERT_ID()")
+    version = cursor.fetchone()[0]
+    cursor.execute(
+        "INSERT INTO timetable_changes (version, entity, entity_id) VALUES (%s, %s, %s)",
+        (version, entity, entity_id)
+    )
+    return version
+
+def record_station_change(cursor, station_id, renamed=False):
+    """
+    Record a station mutation in the change log and return the last version.
+
+    Train schedules embed the names of their stations, so when a station is
+    renamed every train stopping there is logged as changed too. Delta syncs and
+    the schedule stream then carry those trains with the new stop names.
+    """
+    version = record_change(cursor, 'station', station_id)
+    if renamed:
+        cursor.execute("SELECT DISTINCT train_id FROM train_stops WHERE station_id = %s", (station_id,))
+        for (train_id,) in cursor.fetchall():
+            version = record_change(cursor, 'train', train_id)
+    return version
+
+VERSION_QUERY = "SELECT version FROM timetable_version WHERE id = 1"
+OLDEST_CHANGE_QUERY = "SELECT MIN(version) FROM timetable_changes"
+CHANGED_ENTITIES_QUERY = """
+    SELECT DISTINCT entity, entity_id FROM timetable_changes
+    WHERE version > %s AND version <= %s
+"""
+
+def get_current_version(cursor):
+    cursor.execute(VERSION_QUERY)
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+def lock_timetable_version(cursor):
+    """
+    Lock the timetable version row until the caller's transaction ends and return the version.
+
+    Writers that validate against the current timetable take this lock first, so
+    no other timetable change can commit between their check and their write.
+    """
+    cursor.execute(VERSION_QUERY + " FOR UPDATE")
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+def compact_changes(cursor, keep):
+    """
+    Drop change log entries older than the latest `keep` versions.
+
+    Clients asking for changes since a compacted version receive a full snapshot.
+    At least one entry is always kept so the log never looks empty.
+    """
+    current = get_current_version(cursor)
+    cursor.execute("DELETE FROM timetable_changes WHERE version <= %s", (current - max(keep, 1),))
+    return cursor.rowcount
+
+def stations_query(station_ids=None):
+    """
+    Build the stations query, optionally limited to `station_ids`.
+
+    Returns a `(sql, params)` tuple, or None when `station_ids` is empty.
+    The query is shared by the Flask routes and the async read path.
+    """
+    query = "SELECT id, name, location, latitude, longitude FROM stations"
+    params = ()
+    if station_ids is not None:
+        if not station_ids:
+            return None
+        query += f" WHERE id IN ({_placeholders(station_ids)})"
+        params = tuple(station_ids)
+    return query, params
+
+def format_stations(rows):
+    # Format the result as a list of dictionaries
+    return [
+        {
+            "id": station[0],
+            "name": station[1],
+            "location": station[2],
+            "latitude": station[3],
+            "longitude": station[4]
+        }
+        for station in rows
+    ]
+
+def train_schedules_query(train_ids=None):
+    """
+    Build the train schedules query, optionally limited to `train_ids`.
+
+    Returns a `(sql, params)` tuple, or None when `train_ids` is empty.
+    """
+    where = ""
+    params = ()
+    if train_ids is not None:
+        if not train_ids:
+            return None
+        where = f"WHERE t.id IN ({_placeholders(train_ids)})"
+        params = tuple(train_ids)
+    return f"""
+        SELECT t.id, t.name, t.description, ts.station_id, s.name AS station_name,
+               ts.arrival_time, ts.departure_time
+        FROM trains t
+        JOIN train_stops ts ON t.id = ts.train_id
+        JOIN stations s ON ts.station_id = s.id
+        {where}
+        ORDER BY t.id, ts.arrival_time
+    """, params
+
+def format_train_schedules(rows):
+    train_schedules = {}
+    for row in rows:
+        train_id, train_name, description, station_id, station_name, arrival, departure = row
+        if train_id not in train_schedules:
+            train_schedules[train_id] = {
+                "name": train_name,
+                "description": description,
+                "stops": []
+            }
+        train_schedules[train_id]["stops"].append({
+            "station_id": station_id,
+            "station_name": station_name,
+            "arrival_time": str(arrival) if arrival is not None else None,
+            "departure_time": str(departure) if departure is not None else None
+        })
+
+    return [{"id": k, **v} for k, v in train_schedules.items()]
+
+def needs_full_sync(since, version, oldest):
+    """
+    Return True when a client at version `since` must receive a full snapshot.
+
+    That is the case for new clients, clients ahead of the current version
+    (e.g. after a database reset) and clients older than the oldest retained
+    change log entry.
+    """
+    compacted = oldest is not None and since < oldest - 1
+    return since <= 0 or since > version or compacted
+
+def group_changes(rows):
+    """Split `CHANGED_ENTITIES_QUERY` rows into changed train and station ids."""
+    changed = {"train": [], "station": []}
+    for entity, entity_id in rows:
+        changed[entity].append(entity_id)
+    return changed
+
+def fetch_stations(cursor, station_ids=None):
+    """
+    Return stations as a list of dictionaries, optionally limited to `station_ids`.
+    """
+    query = stations_query(station_ids)
+    if query is None:
+        return []
+    cursor.execute(*query)
+    return format_stations(cursor.fetchall())
+
+def fetch_train_schedules(cursor, train_ids=None):
+    """
+    Return train schedules with their stops, optionally limited to `train_ids`.
+    """
+    query = train_schedules_query(train_ids)
+    if query is None:
+        return []
+    cursor.execute(*query)
+    return format_train_schedules(cursor.fetchall())
+
+def get_changes_since(cursor, since):
+    """
+    Build a timetable delta for a client that last synced at version `since`.
+
+    Returns a dictionary with the new `version`, a `full` flag, and the changed
+    `trains` and `stations`. See `needs_full_sync` for when a full snapshot is
+    returned instead.
+    """
+    version = get_current_version(cursor)
+    cursor.execute(OLDEST_CHANGE_QUERY)
+    oldest = cursor.fetchone()[0]
+
+    if needs_full_sync(since, version, oldest):
+        return {
+            "version": version,
+            "full": True,
+            "trains": fetch_train_schedules(cursor),
+            "stations": fetch_stations(cursor)
+        }
+
+    cursor.execute(CHANGED_ENTITIES_QUERY, (since, version))
+    changed = group_changes(cursor.fetchall())
+
+    return {
+        "version": version,
+        "full": False,
+        "trains": fetch_train_schedules(cursor, changed["train"]),
+        "stations": fetch_stations(cursor, changed["station"])
+    }
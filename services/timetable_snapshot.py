@@ -0,0 +1,264 @@
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import timedelta
+
+from config import Config
+from services.timetable_service import get_current_version
+
+# File layout (native byte order, every array is 4-byte aligned):
+#   header: magic, timetable version, trains, stops, stations, strings, string bytes
+#   train_ids[trains]           int32, sorted
+#   train_names[trains]         uint32 string index
+#   train_descriptions[trains]  uint32 string index
+#   train_stop_offsets[trains + 1] uint32, stops of train i are [offsets[i], offsets[i + 1])
+#   stop_stations[stops]        uint32 station index
+#   stop_arrivals[stops]        int32 seconds since midnight, NULL_TIME if unknown
+#   stop_departures[stops]      int32 seconds since midnight, NULL_TIME if unknown
+#   station_ids[stations]       int32
+#   station_names[stations]     uint32 string index
+#   string_offsets[strings + 1] uint32 byte offsets into the UTF-8 string blob
+#   string blob
+# A string index of NULL_STRING stands for a NULL column value.
+MAGIC = b'TTSNAP02'
+HEADER = struct.Struct('=8sQIIIII4x')
+NULL_STRING = 0xFFFFFFFF
+NULL_TIME = -2 ** 31  # TIME values are within +-839 hours, so this never collides
+
+
+def _seconds(value):
+    if value is None:
+        return NULL_TIME
+    if isinstance(value, timedelta):
+        return int(value.total_seconds())
+    hours, minutes, seconds = (int(part) for part in str(value).split(':'))
+    return hours * 3600 + minutes * 60 + seconds
+
+def _time_string(seconds):
+    # Same format as str() of the TIME values returned by the MySQL drivers
+    return str(timedelta(seconds=seconds)) if seconds != NULL_TIME else None
+
+
+def build_snapshot(cursor, path):
+    """
+    Write a compact binary timetable snapshot to `path` and return its version.
+
+    The file is written to a temporary file next to `path` and renamed over it,
+    so readers always see either the old or the new snapshot, never a partial one.
+    """
+    version = get_current_version(cursor)
+
+    cursor.execute("SELECT id, name FROM stations ORDER BY id")
+    stations = cursor.fetchall()
+    cursor.execute("""
+        SELECT t.id, t.name, t.description, ts.station_id, ts.arrival_time, ts.departure_time
+        FROM trains t
+        JOIN train_stops ts ON t.id = ts.train_id
+        JOIN stations s ON ts.station_id = s.id
+        ORDER BY t.id, ts.arrival_time
+    """)
+    rows = cursor.fetchall()
+
+    strings = {}
+
+    def intern(value):
+        if value is None:
+            return NULL_STRING
+        return strings.setdefault(value, len(strings))
+
+    station_ids = array('i')
+    station_names = array('I')
+    station_index = {}
+    for station_id, name in stations:
+        station_index[station_id] = len(station_ids)
+        station_ids.append(station_id)
+        station_names.append(intern(name))
+
+    train_ids, train_names, train_descriptions = array('i'), array('I'), array('I')
+    train_stop_offsets = array('I')
+    stop_stations, stop_arrivals, stop_departures = array('I'), array('i'), array('i')
+    for train_id, name, description, station_id, arrival, departure in rows:
+        if not train_ids or train_ids[-1] != train_id:
+            train_ids.append(train_id)
+            train_names.append(intern(name))
+            train_descriptions.append(intern(description))
+            train_stop_offsets.append(len(stop_stations))
+        stop_stations.append(station_index[station_id])
+        stop_arrivals.append(_seconds(arrival))
+        stop_departures.append(_seconds(departure))
+    train_stop_offsets.append(len(stop_stations))
+
+    blob = bytearray()
+    string_offsets = array('I', [0])
+    for value in strings:  # Dicts keep insertion order, which matches the indexes
+        blob += value.encode('utf-8')
+        string_offsets.append(len(blob))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.timetable-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as snapshot_file:
+            snapshot_file.write(HEADER.pack(
+                MAGIC, version, len(train_ids), len(stop_stations), len(station_ids),
+                len(strings), len(blob)
+            ))
+            for values in (train_ids, train_names, train_descriptions, train_stop_offsets,
+                           stop_stations, stop_arrivals, stop_departures,
+                           station_ids, station_names, string_offsets):
+                snapshot_file.write(values.tobytes())
+            snapshot_file.write(blob)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+    return version
+
+
+def read_snapshot_version(path):
+    """Return the timetable version stored in the snapshot at `path`, or None."""
+    try:
+        with open(path, 'rb') as snapshot_file:
+            header = snapshot_file.read(HEADER.size)
+    except FileNotFoundError:
+        return None
+    if len(header) < HEADER.size or header[:len(MAGIC)] != MAGIC:
+        return None
+    return HEADER.unpack(header)[1]
+
+
+class TimetableSnapshot:
+    """
+    Read-only, memory-mapped view of a snapshot written by `build_snapshot`.
+
+    All processes mapping the same file share its pages through the OS page
+    cache. Accessors read straight from the mapping through typed memoryviews,
+    without copying the arrays into Python objects.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as snapshot_file:
+            self._map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.version, trains, stops, stations, strings, blob_size = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a timetable snapshot")
+
+        view = memoryview(self._map)
+        offset = HEADER.size
+
+        def take(count, typecode):
+            nonlocal offset
+            values = view[offset:offset + count * 4].cast(typecode)
+            offset += count * 4
+            return values
+
+        self.train_ids = take(trains, 'i')
+        self._train_names = take(trains, 'I')
+        self._train_descriptions = take(trains, 'I')
+        self._train_stop_offsets = take(trains + 1, 'I')
+        self._stop_stations = take(stops, 'I')
+        self._stop_arrivals = take(stops, 'i')
+        self._stop_departures = take(stops, 'i')
+        self.station_ids = take(stations, 'i')
+        self._station_names = take(stations, 'I')
+        self._string_offsets = take(strings + 1, 'I')
+        self._strings = view[offset:offset + blob_size]
+
+    def __len__(self):
+        return len(self.train_ids)
+
+    def _string(self, index):
+        if index == NULL_STRING:
+            return None
+        return str(self._strings[self._string_offsets[index]:self._string_offsets[index + 1]], 'utf-8')
+
+    def find_train(self, train_id):
+        """Return the position of `train_id` in the snapshot, or None (binary search)."""
+        position = bisect_left(self.train_ids, train_id)
+        if position < len(self.train_ids) and self.train_ids[position] == train_id:
+            return position
+        return None
+
+    def stops(self, position):
+        """
+        Return (station_id, arrival_seconds, departure_seconds) for each stop of the
+        train at `position`, in arrival order. Unknown times are `NULL_TIME`.
+        """
+        start, end = self._train_stop_offsets[position], self._train_stop_offsets[position + 1]
+        return [
+            (self.station_ids[self._stop_stations[stop]], self._stop_arrivals[stop], self._stop_departures[stop])
+            for stop in range(start, end)
+        ]
+
+    def train_schedule(self, position):
+        """Return the train at `position` in the same format as `GET /trains`."""
+        start, end = self._train_stop_offsets[position], self._train_stop_offsets[position + 1]
+        stops = []
+        for stop in range(start, end):
+            station = self._stop_stations[stop]
+            stops.append({
+                "station_id": self.station_ids[station],
+                "station_name": self._string(self._station_names[station]),
+                "arrival_time": _time_string(self._stop_arrivals[stop]),
+                "departure_time": _time_string(self._stop_departures[stop])
+            })
+        return {
+            "id": self.train_ids[position],
+            "name": self._string(self._train_names[position]),
+            "description": self._string(self._train_descriptions[position]),
+            "stops": stops
+        }
+
+    def train_schedules(self):
+        return [self.train_schedule(position) for position in range(len(self))]
+
+
+class SnapshotLoader:
+    """
+    Keeps the current `TimetableSnapshot` for this process.
+
+    The snapshot file is checked at most every `check_interval` seconds. When it
+    has been replaced, the new file is mapped and swapped in with a single
+    reference assignment. Requests still using the old snapshot keep it alive
+    until they finish, and then its mapping is released.
+    """
+
+    def __init__(self, path, check_interval=5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._file_id = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def current(self):
+        """Return the latest snapshot, or None if no snapshot file exists."""
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            with self._lock:
+                if now - self._checked_at >= self.check_interval:
+                    self._reload()
+                    self._checked_at = now
+        return self._snapshot
+
+    def _reload(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._snapshot, self._file_id = None, None
+            return
+        file_id = (stat.st_ino, stat.st_mtime_ns)
+        if file_id != self._file_id:
+            self._snapshot = TimetableSnapshot(self.path)
+            self._file_id = file_id
+
+
+timetable_snapshot = SnapshotLoader(Config.TIMETABLE_SNAPSHOT_PATH)
@@ -0,0 +1,10 @@
+TRANSACTION_HISTORY_QUERY = """
+    SELECT amount, type, timestamp FROM transactions WHERE user_id = %s ORDER BY timestamp DESC
+"""
+
+def format_transactions(rows):
+    # Format the transactions as a list of dictionaries
+    return [
+        {"amount": amount, "type": trans_type, "timestamp": timestamp.strftime('%Y-%m-%d %H:%M:%S')}
+        for (amount, trans_type, timestamp) in rows
+    ]
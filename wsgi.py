@@ -0,0 +1,7 @@
+from app import create_app, warm_app
+
+# Production entry point: `gunicorn -c gunicorn.conf.py wsgi:app`
+# With `preload_app` this module is imported once in the master process, so the
+# app is built and warmed before workers are forked and shared copy-on-write.
+app = create_app()
+warm_app(app)